@@ -42,27 +42,33 @@ class Bot(commands.Bot):
         print("Connecting...")
         path = Path("./bot.db").resolve()
         await self.db.connect(path)
+        # The watcher starts polling on ready, since the loop its cog was loaded on is gone by now
+        if config.asset_poll_interval is not None and (watcher := self.get_cog("Watcher")) is not None:
+            if not watcher.poll.is_running():
+                print("The asset watcher isn't running, assets won't reload on their own!")
         print(f"Logged in as {self.user}!")
 
-bot = Bot(
-    # Prefixes
-    [],
-    activity=config.activity,
-    description=config.description,
-    # Never mention roles, @everyone or @here
-    allowed_mentions=discord.AllowedMentions(everyone=False, roles=False),
-    intents=discord.Intents(),
-    # Disable the member cache
-    member_cache_flags=discord.MemberCacheFlags.none(),
-    # Disable the message cache
-    max_messages=None,
-    # Don't chunk guilds
-    chunk_guilds_at_startup=False,
-)
+# The render workers import this module too, and they shouldn't start bots of their own
+if __name__ == "__main__":
+    bot = Bot(
+        # Prefixes
+        [],
+        activity=config.activity,
+        description=config.description,
+        # Never mention roles, @everyone or @here
+        allowed_mentions=discord.AllowedMentions(everyone=False, roles=False),
+        intents=discord.Intents(),
+        # Disable the member cache
+        member_cache_flags=discord.MemberCacheFlags.none(),
+        # Disable the message cache
+        max_messages=None,
+        # Don't chunk guilds
+        chunk_guilds_at_startup=False,
+    )
 
-discord.utils.setup_logging()
+    discord.utils.setup_logging()
 
-try:
-    bot.run(auth.token, log_handler=None)
-finally:
-    asyncio.run(bot.close())
+    try:
+        bot.run(auth.token, log_handler=None)
+    finally:
+        asyncio.run(bot.close())
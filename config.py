@@ -1,4 +1,17 @@
 import discord
 
 activity = discord.Game(name="happy april fools!!!")
-description = "happy april fools!!!"
\ No newline at end of file
+description = "happy april fools!!!"
+# Processes used for rendering. None uses one per core, and 0 renders in the bot's own process.
+# The render caches in src/constants.py are split between them, so more workers don't use more memory.
+render_workers: int | None = None
+# zlib level for PNGs. Lower is faster, and renders that end up too large get compressed harder anyway.
+png_compression: int = 1
+# Tiles whose sprites are decoded on startup instead of on their first render.
+warm_tiles: list[str] = ["bab", "keek", "wal", "til", "txt_bab", "txt_be", "txt_u"]
+# Decodes every tile's sprites on startup and keeps them all in memory, instead of only the ones above.
+preload_sprites: bool = False
+# Seconds between checks for changed assets, which get reloaded on their own. None turns this off.
+asset_poll_interval: float | None = 5
+# Read-only database connections, on top of the one that writes.
+db_readers: int = 4
@@ -0,0 +1,87 @@
+import numpy as np
+
+# All of these work on premultiplied RGBA, stored as uint8.
+# Intermediate values never leave 16 bits for "normal", and 32 bits for the rest.
+BLEND_MODES = ("normal", "multiply", "add", "screen", "subtract", "overlay")
+
+
+def div255(arr: np.ndarray) -> np.ndarray:
+    """Divides by 255 with rounding, without touching floats. Exact for anything up to 255 * 255."""
+    arr += 128
+    arr += arr >> 8
+    arr >>= 8
+    return arr
+
+
+def premultiply(image: np.ndarray) -> np.ndarray:
+    """Converts a straight alpha RGBA image into a premultiplied one."""
+    out = image.astype(np.uint16)
+    out[..., :3] *= out[..., 3:]
+    div255(out[..., :3])
+    return out.astype(np.uint8)
+
+
+# Fixed-point 255 / alpha, so unpremultiplying is a lookup, a multiply and a shift instead of a division
+_UNPREMULTIPLY = np.array([0, *((255 << 16) // alpha for alpha in range(1, 256))], dtype=np.uint32)
+
+
+def unpremultiply(image: np.ndarray) -> np.ndarray:
+    """Converts a premultiplied RGBA image back into a straight alpha one."""
+    alpha = image[..., 3]
+    # Fully opaque and fully transparent pixels are the same either way, and they're most of any render
+    partial = (alpha != 0) & (alpha != 255)
+    count = np.count_nonzero(partial)
+    out = image.copy()
+    if count * 4 > partial.size:
+        scale = _UNPREMULTIPLY[image[..., 3:]]
+        out[..., :3] = np.minimum((image[..., :3] * scale + (1 << 15)) >> 16, 255)
+    elif count:
+        partial = np.nonzero(partial)
+        pixels = image[partial]
+        scale = _UNPREMULTIPLY[pixels[:, 3:]]
+        out[partial + (slice(None, 3),)] = np.minimum((pixels[:, :3] * scale + (1 << 15)) >> 16, 255)
+    return out
+
+
+def blend(dst: np.ndarray, src: np.ndarray, mode: str = "normal") -> None:
+    """Composites `src` on top of `dst`, writing the result into `dst`."""
+    assert src.shape == dst.shape, f"Shape mismatch of {src.shape=} and {dst.shape=}"
+    assert mode in BLEND_MODES, f"wat is blenn mod `{mode}`??"
+    if mode == "normal":
+        # co = cs + cb * (1 - as), which is also how the alpha channel is composited for every mode
+        out = dst.astype(np.uint16)
+        out *= 255 - src[..., 3:].astype(np.uint16)
+        div255(out)
+        out += src
+        dst[...] = out
+        return
+    s, d = src.astype(np.int32), dst.astype(np.int32)
+    sa, da = s[..., 3:], d[..., 3:]
+    cs, cb = s[..., :3], d[..., :3]
+    # Premultiplied form of the separable blend modes, scaled by 255 * 255:
+    # co = cs * (1 - ab) + cb * (1 - as) + as * ab * B(Cb, Cs)
+    if mode == "multiply":
+        mixed = cs * cb
+    elif mode == "screen":
+        mixed = cs * da + cb * sa - cs * cb
+    elif mode == "add":
+        mixed = np.minimum(cs * da + cb * sa, sa * da)
+    elif mode == "subtract":
+        mixed = np.maximum(cb * sa - cs * da, 0)
+    else:  # overlay
+        mixed = np.where(2 * cb <= da, 2 * cs * cb, sa * da - 2 * (da - cb) * (sa - cs))
+    mixed += cs * (255 - da)
+    mixed += cb * (255 - sa)
+    out_a = div255(d[..., 3:] * (255 - sa)) + sa
+    dst[..., :3] = np.minimum(div255(mixed), out_a)
+    dst[..., 3:] = out_a
+
+
+def paste(image: np.ndarray, sprite: np.ndarray, y: int, x: int, mode: str = "normal") -> None:
+    """Blends a sprite onto an image with its top left corner at (x, y), clipping whatever's out of bounds."""
+    h, w = sprite.shape[:2]
+    top, left = max(y, 0), max(x, 0)
+    bottom, right = min(y + h, image.shape[0]), min(x + w, image.shape[1])
+    if top >= bottom or left >= right:
+        return
+    blend(image[top:bottom, left:right], sprite[top - y:bottom - y, left - x:right - x], mode)
@@ -0,0 +1,69 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """A least-recently-used cache, bounded by the total size of its values instead of their count."""
+
+    def __init__(self, max_size: int | None, sizeof: Callable[[Any], int] = lambda value: value.nbytes):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            value, _ = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        size = self.sizeof(value)
+        if self.max_size is not None and size > self.max_size:
+            # It'd just evict everything else and then itself
+            return
+        self.pop(key)
+        self._entries[key] = value, size
+        self.size += size
+        while self.max_size is not None and self.size > self.max_size:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._entries:
+            return default
+        value, size = self._entries.pop(key)
+        self.size -= size
+        return value
+
+    def discard_if(self, predicate: Callable[[Hashable], bool]):
+        """Removes every entry whose key matches a predicate."""
+        for key in [key for key in self._entries if predicate(key)]:
+            self.pop(key)
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(entries={len(self)}, size={self.size}/{self.max_size}, "
+                f"hits={self.hits}, misses={self.misses}, evictions={self.evictions}, hit_rate={self.hit_rate:.1%})")
@@ -1,5 +1,6 @@
 import re
 from io import BytesIO
+from typing import Literal
 
 import discord
 from discord.ext import commands
@@ -8,9 +9,12 @@ from discord import app_commands, Interaction
 from discord.app_commands import Choice
 
 from src import constants
-from src.types import Bot, TileSkeleton, RenderingContext, Tile
+from src.types import Bot, TileSkeleton, RenderingContext
 from src.utils import respond
 
+# A tile in a grid, and the separator after it, which can be escaped with a backslash
+GRID_TOKEN = re.compile(r"((?:[^ ,+]|(?<=\\)[ ,+])*)([ ,+]?)")
+
 
 class GlobalCog(commands.Cog, name="Global"):
     def __init__(self, bot: Bot):
@@ -28,10 +32,12 @@ class GlobalCog(commands.Cog, name="Global"):
             rul: bool = False,
             bg: str = None,
             palette: str = "default",
-            file: discord.Attachment | None = None
+            file: discord.Attachment | None = None,
+            frames: app_commands.Range[int, 1, constants.MAX_FRAMES] = 1,
+            format: Literal["png", "gif", "webp"] = "png"
     ):
         await interaction.response.defer(thinking=True, ephemeral=ephemeral)
-        ctx = RenderingContext(spacing, upscale, palette, (0, 0, 0, 0), 0, 0, rul)
+        ctx = RenderingContext(spacing, upscale, palette, (0, 0, 0, 0), 0, 0, rul, frames, format)
         assert palette in self.bot.db.palettes, f"idk where `{palette}` is ask ur gps"
         ctx.palette = palette
         if bg is not None:
@@ -51,25 +57,35 @@ class GlobalCog(commands.Cog, name="Global"):
             grid = str(await file.read(), "utf-8")
         raw_tiles = list(self.parse_grid(grid, rul))
         # TODO: POST-PARSE SHIT
-        tiles = await Tile.build_tiles(raw_tiles, ctx, self.bot)
-        buf = BytesIO()
-        assert len(tiles), "wher tils"
-        tiles = await self.bot.renderer.process(tiles, ctx)
-        await self.bot.renderer.render(tiles, buf, ctx)
-        return await respond(interaction, content=None, file=discord.File(buf, filename="render.png"))
+        out, format = await self.bot.renderer.render_cached(raw_tiles, ctx)
+        return await respond(interaction, content=None, file=discord.File(BytesIO(out), filename=f"render.{format}"))
 
     @til.autocomplete("grid")
     async def complete_tile(self, interaction: Interaction, value: str):
-        current_tile = re.split(r"(?<!\\)\+", re.split(r"(?<!\\),", re.split(r"(?<!\\) ", value)[-1])[-1])[-1]
-        tile = TileSkeleton.parse(current_tile, (0, 0), 0, self.bot.variants)
-        if len(tile.variants): return []
-        return [Choice(name=name, value=name) for name in self.bot.db.tiles if name.startswith(tile.name)][:25]
+        current_tile = re.split(r"(?<!\\)[ ,+]", value)[-1]
+        try:
+            tile = TileSkeleton.parse(current_tile, (0, 0), self.bot.variants)
+        except AssertionError:
+            return []
+        if tile is None or len(tile.variants): return []
+        return [Choice(name=name, value=name) for name in self.bot.db.tile_index.complete(tile.name)]
 
     def parse_grid(self, grid, rule: bool = False):
-        for y, row in enumerate(re.split(r"(?<!\\) ", grid)):
-            for x, cell in enumerate(re.split(r"(?<!\\),", row)):
-                for z, tile in enumerate(re.split(r"(?<!\\)\+", cell)):
-                    yield TileSkeleton.parse(tile, (x, y), self.bot.variants, layer=z)
+        x = y = z = 0
+        position = 0
+        while True:
+            token = GRID_TOKEN.match(grid, position)
+            tile, separator = token.groups()
+            yield TileSkeleton.parse(tile, (x, y), self.bot.variants, layer=z)
+            if not separator:
+                return
+            position = token.end()
+            if separator == "+":
+                z += 1
+            elif separator == ",":
+                x, z = x + 1, 0
+            else:
+                x, y, z = 0, y + 1, 0
 
 
 async def setup(bot: Bot):
@@ -1,13 +1,15 @@
 import dataclasses
 import json
 from io import BytesIO
-from pathlib import Path
+from typing import Literal
 
 import discord
 from discord import app_commands, Interaction
+from discord.app_commands import Choice
 from discord.ext import commands
 
-from src.types import Bot, LevelData, RenderingContext, Tile
+from src import constants, worker
+from src.types import Bot, RenderingContext
 from src.utils import respond
 
 
@@ -23,20 +25,19 @@ class LevelCog(commands.Cog, name="Levels"):
             world: str = None,
             name: str = None,
             file: discord.Attachment = None,
-            ephemeral: bool = False
+            ephemeral: bool = False,
+            frames: app_commands.Range[int, 1, constants.MAX_FRAMES] = 1,
+            format: Literal["png", "gif", "webp"] = "png"
     ):
         await interaction.response.defer(thinking=True, ephemeral=ephemeral)
         if file is not None:
-            level = json.loads(await file.read())
+            level_data = await self.bot.renderer.submit(worker.parse_level, json.loads(await file.read()))
+        elif name in self.bot.db.level_names:
+            level_data = self.bot.db.level_names[name]
         else:
-            if name in self.bot.db.worlds:
-                world, name = self.bot.db.level_names[name]
-            else:
-                assert world in self.bot.db.worlds, f"wher is `{world}`??"
-                assert name in self.bot.db.worlds[world], f"wher is `{name}`??"
-            with open(Path("data/bab/officialworlds") / world):
-                pass
-        level_data = LevelData.from_json(level, self.bot)
+            assert world in self.bot.db.worlds, f"wher is `{world}`??"
+            assert name in self.bot.db.worlds[world], f"wher is `{name}`??"
+            level_data = self.bot.db.worlds[world][name]
         assert level_data is not None, "ur lvl didnt pars!!"
         """
             spacing: int = constants.TILE_SIZE
@@ -47,22 +48,25 @@ class LevelCog(commands.Cog, name="Levels"):
     height: int = 0
     rul: bool = False
     """
-        print({k: v for k, v in level_data})
         bg = self.bot.db.palettes[level_data.palette][4, 0]
         ctx = RenderingContext(
             upscale=1,
             palette=level_data.palette,
             bg=bg,
             width=level_data.width,
-            height=level_data.height
+            height=level_data.height,
+            frames=frames,
+            format=format
         )
-        tiles = await Tile.build_tiles(level_data.tiles, ctx, self.bot)
-        tiles = await self.bot.renderer.process(tiles, ctx)
-        with BytesIO() as buf:
-            await self.bot.renderer.render(tiles, buf, ctx)
-            await respond(interaction, content=f"""> _`{level_data.name}` by `{level_data.author}`_""", file=discord.File(buf, filename=f"{level_data.name}.png"))
+        out, format = await self.bot.renderer.render_cached(level_data.tiles, ctx)
+        with BytesIO(out) as buf:
+            await respond(interaction, content=f"""> _`{level_data.name}` by `{level_data.author}`_""", file=discord.File(buf, filename=f"{level_data.name}.{format}"))
         return
 
+    @lvl.autocomplete("name")
+    async def complete_level(self, interaction: Interaction, current: str):
+        return [Choice(name=name, value=name) for name in self.bot.db.level_index.complete(current)]
+
 
 async def setup(bot: Bot):
     await bot.add_cog(LevelCog(bot))
@@ -15,8 +15,6 @@ from src import constants
 from src.types import Bot, TileSkeleton, RenderingContext, Tile
 from src.utils import respond
 
-palettes = []
-
 
 class Paginated(discord.ui.View):
     def __init__(self, interaction: Interaction, *pages: discord.Embed):
@@ -40,9 +38,7 @@ class Paginated(discord.ui.View):
 
 class MetaCog(commands.Cog, name="Meta"):
     def __init__(self, bot: Bot):
-        global palettes
         self.bot = bot
-        palettes = list(bot.db.palettes.keys())
 
     @app_commands.command()
     async def palette(self, interaction: Interaction, name: str, x: int | None = None, y: int | None = None):
@@ -70,8 +66,7 @@ class MetaCog(commands.Cog, name="Meta"):
     # Name can't be a Choice[str] because there's a 25-option limit
     @palette.autocomplete("name")
     async def palette_autocomplete(self, interaction: Interaction, current: str):
-        new_pals = [pal for pal in palettes if pal.startswith(current)]
-        return [Choice(name=name, value=name) for name in new_pals[:25]]
+        return [Choice(name=name, value=name) for name in self.bot.db.palette_index.complete(current)]
 
     @app_commands.command()
     async def about(self, interaction: Interaction, ephemeral: bool = True):
@@ -106,9 +101,7 @@ _Happy April Fool's Day, -balt_"""
 
     @variants.autocomplete("variant")
     async def autocomplete_variant(self, interaction: Interaction, current: str):
-        names = [variant.__name__.removesuffix("Variant") for variant in self.bot.variants]
-        names = [name for name in names if name.lower().startswith(current.lower())]
-        return [Choice(name=name, value=name) for name in names[:25]]
+        return [Choice(name=name, value=name) for name in self.bot.variants.name_index.complete(current)]
 
 
 async def setup(bot: Bot):
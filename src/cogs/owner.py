@@ -1,15 +1,10 @@
 import asyncio
-import json
-import os
 import re
 import shutil
-import struct
-import time
 import traceback
-import warnings
 from contextlib import redirect_stdout, redirect_stderr
 from functools import reduce
-from io import BytesIO, StringIO
+from io import StringIO
 from pathlib import Path
 import ast
 
@@ -20,7 +15,7 @@ from discord import app_commands, Interaction, ui
 from discord.app_commands import Choice, Group, AppCommandError
 from discord.ext.commands import ExtensionNotLoaded
 
-from src import constants
+from src import constants, worker
 from src.types import Bot, TileData
 from src.utils import *
 
@@ -62,57 +57,16 @@ class OwnerCog(commands.GroupCog, group_name="owner", group_description="Owner-o
 
     @load_group.command()
     async def tiles(self, interaction: Interaction, flush: bool = False):
-        tiles_loaded = 0
         await interaction.response.defer(ephemeral=True, thinking=True)
         if flush:
-            async with self.bot.db.conn.cursor() as cur:
-                await cur.execute("DELETE FROM tiles")
-            start = time.perf_counter()
-            for path in Path("data/bab/assets/tiles").glob("*/*.json"):
-                with open(path, "r") as f:
-                    tiles = json.load(f)
-                for tile in tiles:
-                    # Create a linked list of sprites
-                    with BytesIO() as buf:
-                        with BytesIO() as buf_sleep:
-                            for i, sprite_path in enumerate(tile["sprite"]):
-                                sprite_path: str
-                                try:
-                                    with open((Path("data/bab/assets/sprites") / sprite_path).with_suffix(".png"),
-                                              "rb") as f:
-                                        f.seek(0, os.SEEK_END)
-                                        buf.write(struct.pack("<L", f.tell()))
-                                        f.seek(0)
-                                        buf.write(f.read())
-                                except FileNotFoundError:
-                                    warnings.warn(f"Can't find sprite {sprite_path}")
-                                try:
-                                    with open((Path("data/bab/assets/sprites") / (sprite_path + "_slep")).with_suffix(".png"),
-                                              "rb") as f:
-                                        f.seek(0, os.SEEK_END)
-                                        buf_sleep.write(struct.pack("<L", f.tell()))
-                                        f.seek(0)
-                                        buf_sleep.write(f.read())
-                                except FileNotFoundError:
-                                    pass
-                            sleep_sprites = buf_sleep.getvalue()
-                            if not len(sleep_sprites):
-                                sleep_sprites = None
-                        sprites = buf.getvalue()
-                    col = " ".join(",".join(str(n) for n in col) for col in tile["color"])
-                    painted = " ".join([
-                        (str(int(paint)) if type(paint) is bool else ",".join(str(n) for n in paint))
-                        for paint in tile["painted"]
-                    ]) if "painted" in tile else None
-                    async with self.bot.db.conn.cursor() as cur:
-                        await cur.execute("""
-                            INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?)
-                        """, tile["name"], col, sprites, sleep_sprites, painted, tile.get("rotate", False), tile.get("layer", None))
-                    tiles_loaded += 1
-                    if time.perf_counter() - start >= 1:
-                        start = time.perf_counter()
-                        await respond(interaction, f"`{tiles_loaded}` tils loded", ephemeral=True, edit=True)
-        await self.bot.db.load_tiles(flush=flush)
+            changed = await self.bot.db.ingest_tiles()
+            if not len(changed):
+                return await respond(interaction, "no tils changd!!", ephemeral=True, edit=True)
+            await self.bot.db.load_tiles(names=changed)
+        else:
+            await self.bot.db.load_tiles()
+        await respond(interaction, "packin atlas...", ephemeral=True, edit=True)
+        await self.bot.db.build_atlas()
         return await respond(interaction, f"tils loded!!", ephemeral=True, edit=True)
 
     @load_group.command()
@@ -126,6 +80,12 @@ class OwnerCog(commands.GroupCog, group_name="owner", group_description="Owner-o
         await self.bot.db.load_worlds()
         return await respond(interaction, "loded wrlds", ephemeral=True)
 
+    @app_commands.command()
+    async def caches(self, interaction: Interaction):
+        # Each render worker has its own caches, so this only shows whichever one picks it up
+        caches = await self.bot.renderer.submit(worker.cache_stats)
+        return await respond(interaction, "\n".join(f"**{name}**: `{cache}`" for name, cache in caches.items()), ephemeral=True)
+
     @app_commands.command()
     async def sync(self, interaction: Interaction, testing: bool = True):
         await self.bot.tree.sync(guild=constants.TESTING_GUILD if testing else None)
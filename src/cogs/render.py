@@ -1,33 +1,112 @@
-import copy
+import asyncio
+import dataclasses
+import hashlib
+import json
 import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
+from typing import Any, Callable, Coroutine
 
 import numpy as np
 import cv2
-from PIL import Image
 
-from src.constants import MAX_SIZE
-from src.types import Bot, Tile, RenderingContext, ProcessedTile
+import config
+from src import worker
+from src.blending import blend, div255, premultiply, unpremultiply, paste
+from src.cache import LRUCache
+from src.encoding import Encoder
+from src.sprites import compile_chain
+from src.constants import MAX_SIZE, TILE_CACHE_SIZE, RECOLOR_CACHE_SIZE, MAX_PENDING_CHANGES
+from src.transform import rotation_scale, transform
+from src.types import Bot, Tile, TileSkeleton, RenderingContext, ProcessedTile, RenderPlan, Draw
 
 
 class Renderer:
     def __init__(self, bot: Bot):
         self.bot = bot
+        self.tile_cache = LRUCache(TILE_CACHE_SIZE)
+        self.recolor_cache = LRUCache(RECOLOR_CACHE_SIZE)
+        # Overlays, keyed by their name and the size they were scaled to
+        self.scaled_overlays: dict[tuple[str, int], np.ndarray] = {}
+        self.pool: ProcessPoolExecutor | None = None
+        # Assets that changed since the pool started, which are sent along with every job so that workers can catch up
+        self.changes: list[tuple[int, str, list[str]]] = []
+        self.change_count = 0
+        self.encoder = Encoder()
+        bot.db.reload_callbacks.append(self.on_reload)
 
-    def blend(self, src, dst, mode):
-        assert src.shape == dst.shape, f"Shape mismatch of {src.shape=} and {dst.shape=}"
-        out_a = (src[..., 3] + dst[..., 3] * (1 - src[..., 3] / 255)).astype(np.uint8)
-        a, b = src[..., :3].astype(float) / 255, dst[..., :3].astype(float) / 255
-        if mode == "normal":
-            c = b
-        # TODO: implement more blending modes
-        else:
-            raise AssertionError(f"wat is blenn mod `{mode}`??")
-        dst_alpha = dst[..., 3].astype(float) / 255
-        dst_alpha = dst_alpha[:, :, np.newaxis]
-        c = ((1 - dst_alpha) * a + dst_alpha * c)
-        c[out_a == 0] = 0
-        return np.dstack((np.clip(c * 255, 0, 255).astype(np.uint8), out_a[..., np.newaxis]))
+    async def submit(self, func: Callable[..., Coroutine], *args: Any) -> Any:
+        """Runs a function from src.worker in the render pool, so the event loop is free while it runs."""
+        if config.render_workers == 0:
+            return await func(self.bot, *args)
+        # A worker dying, say from running out of memory, breaks the whole pool,
+        # so it's replaced and the job is tried once more on a fresh one
+        for attempt in range(2):
+            if self.pool is None:
+                # Forking would copy the event loop and gateway connection along with it
+                self.pool = ProcessPoolExecutor(
+                    config.render_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=worker.initialize,
+                    initargs=(self.bot.db.path, config.render_workers or os.cpu_count() or 1)
+                )
+            pool = self.pool
+            try:
+                return await asyncio.get_running_loop().run_in_executor(pool, worker.call, self.changes, func, *args)
+            except BrokenProcessPool:
+                # Other jobs that were on the broken pool might have replaced it already
+                if self.pool is pool:
+                    self.shutdown()
+        raise AssertionError("the renderr crashd!! try smth smaller??")
+
+    def render_key(self, skeletons: list[TileSkeleton | None], ctx: RenderingContext) -> str:
+        """Hashes everything that goes into a render, so identical renders can be looked up."""
+        canonical = json.dumps([
+            [
+                [skel.name, [[type(variant).__name__, variant.args] for variant in skel.variants],
+                 skel.x, skel.y, skel.z, skel.color]
+                for skel in skeletons if skel is not None
+            ],
+            {**dataclasses.asdict(ctx), "bg": [int(channel) for channel in ctx.bg]},
+            # Only the assets this render uses, so that a change to one doesn't throw out every render
+            sorted((*asset, self.bot.db.asset_hashes.get(asset)) for asset in self.assets(skeletons, ctx))
+        ], separators=(",", ":"), default=repr)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def assets(skeletons: list[TileSkeleton | None], ctx: RenderingContext) -> set[tuple[str, str]]:
+        """Finds every asset a render could depend on."""
+        assets = {("palettes", ctx.palette)}
+        for skel in skeletons:
+            if skel is None:
+                continue
+            assets.add(("tiles", Tile.resolve_name(skel.name, ctx.rul)))
+            for variant in skel.variants:
+                # Variants name palettes and overlays by their name
+                for arg in variant.args:
+                    if isinstance(arg, str):
+                        assets.add(("palettes", arg))
+                        assets.add(("overlays", arg))
+        return assets
+
+    async def render_cached(self, skeletons: list[TileSkeleton | None], ctx: RenderingContext) -> tuple[bytes, str]:
+        """Renders tiles in the render pool, unless the same render is already on disk."""
+        key = self.render_key(skeletons, ctx)
+        if (cached := await self.bot.db.cached_render(key)) is not None:
+            return cached
+        out, format = await self.submit(worker.render_tiles, skeletons, ctx)
+        await self.bot.db.cache_render(key, out, format)
+        return out, format
+
+    def shutdown(self):
+        if self.pool is not None:
+            # Running renders are left to finish with the data they started with
+            self.pool.shutdown(wait=False)
+            self.pool = None
+        self.changes = []
 
     def recolor(
             self,
@@ -40,11 +119,10 @@ class Renderer:
         if isinstance(color, str):
             if (isinstance(paint, bool) and paint) or force:
                 assert color in self.bot.db.overlays, f"what is overlayy `{color}`?? ?"
-                overlay = self.bot.db.overlays[color]
-                max_size = max(sprite.shape[:2])
-                overlay = cv2.resize(overlay, (max_size, max_size), interpolation=cv2.INTER_NEAREST)
-                overlay = overlay[:sprite.shape[0], :sprite.shape[1]]
-                return np.multiply(sprite, overlay, casting="unsafe").astype(np.uint8)
+                overlay = self.scaled_overlay(color, max(sprite.shape[:2]))
+                out = sprite.astype(np.uint16)
+                out *= overlay[:sprite.shape[0], :sprite.shape[1]]
+                return div255(out).astype(np.uint8)
             else:
                 color = paint
         if len(color) < 3:
@@ -53,105 +131,239 @@ class Renderer:
             color = pal[*color[::-1]]
         if len(color) < 4:
             color = *color, 0xFF
-        color = np.array(color, dtype=float) / 255
-        return np.multiply(sprite, color.reshape(1, 1, 4), casting="unsafe").astype(np.uint8)
+        out = sprite.astype(np.uint16)
+        out *= np.array(color, dtype=np.uint16)
+        return div255(out).astype(np.uint8)
+
+    def scaled_overlay(self, name: str, size: int) -> np.ndarray:
+        """Gets an overlay stretched to a square of the given size, which only happens once per size."""
+        if (overlay := self.scaled_overlays.get((name, size))) is None:
+            overlay = cv2.resize(self.bot.db.overlays[name], (size, size), interpolation=cv2.INTER_NEAREST)
+            overlay.flags.writeable = False
+            self.scaled_overlays[name, size] = overlay
+        return overlay
+
+    def on_reload(self, kind: str, names: list[str] | None = None):
+        if names is None:
+            self.tile_cache.clear()
+            self.recolor_cache.clear()
+            self.scaled_overlays.clear()
+            # The workers load their assets once on startup, so new ones are needed
+            self.shutdown()
+            return
+        names = set(names)
+        # Processed tiles are keyed by (name, slep, variants, colors, painted, palette),
+        # and recolored layers by (name, slep, variants, layer, color, paint, palette)
+        if kind == "tiles":
+            self.tile_cache.discard_if(lambda key: key[0] in names)
+            self.recolor_cache.discard_if(lambda key: key[0] in names)
+        elif kind == "palettes":
+            self.tile_cache.discard_if(lambda key: key[-1] in names)
+            self.recolor_cache.discard_if(lambda key: key[-1] in names)
+        elif kind == "overlays":
+            # Overlays are named in place of a color
+            self.tile_cache.discard_if(lambda key: any(color in names for color in key[3] if isinstance(color, str)))
+            self.recolor_cache.discard_if(lambda key: isinstance(key[4], str) and key[4] in names)
+            for key in [key for key in self.scaled_overlays if key[0] in names]:
+                del self.scaled_overlays[key]
+        self.change_count += 1
+        self.changes.append((self.change_count, kind, sorted(names)))
+        if len(self.changes) > MAX_PENDING_CHANGES:
+            # Fresh workers are cheaper than sending every job this much
+            self.shutdown()
 
     async def process(self, tiles: list[Tile], ctx: RenderingContext) -> list[ProcessedTile]:
         processed_tile_list = []
-        tile_cache = {}
         for tile in tiles:
-            if (tile_hash := hash(tile)) in tile_cache:
-                final_tile = copy.deepcopy(tile_cache[tile_hash])  # A deepcopy is needed here :P
-                final_tile.x = tile.x
-                final_tile.y = tile.y
-                final_tile.z = tile.z
-            else:
-                for i, variant in enumerate(tile.variants):
-                    if variant.type == "sprite":
-                        await variant.call(tile)
-                        del tile.variants[i]
-                sprites = tile.sprites
+            key = tile.key
+            if (out := self.tile_cache.get(key)) is None:
+                if (chain := compile_chain(key[2])) is not None:
+                    sprites = chain(tile.sprites)
+                else:
+                    for variant in tile.variants:
+                        if variant.type == "sprite":
+                            await variant.call(tile)
+                    sprites = tile.sprites
                 w, h = 0, 0
                 for i, sprite in enumerate(sprites):
-                    sprites[i] = sprite
                     w = max(w, sprite.shape[1])
                     h = max(h, sprite.shape[0])
                 out = np.zeros((h, w, 4), dtype=np.uint8)
                 for i, sprite in enumerate(sprites):
-                    sprite = self.recolor(sprite, tile.colors[i], tile.painted[i], tile.palette)
+                    # The first few parts of the key are where the sprite came from
+                    layer_key = (*key[:3], i, key[3][i], key[4][i], tile.palette)
+                    if (layer := self.recolor_cache.get(layer_key)) is None:
+                        layer = premultiply(self.recolor(sprite, tile.colors[i], tile.painted[i], tile.palette))
+                        layer.flags.writeable = False
+                        self.recolor_cache[layer_key] = layer
+                    sprite = layer
                     bounds = (
                         slice(int((h - sprite.shape[0]) // 2), int(((h + sprite.shape[0]) // 2))),
                         slice(int((w - sprite.shape[1]) // 2), int(((w + sprite.shape[1]) // 2)))
                     )
-                    out[bounds] = self.blend(out[bounds], sprite, "normal")
-                final_tile = ProcessedTile(
-                    tile.name,
-                    out,
-                    tile.x,
-                    tile.y,
-                    tile.z,
-                    tile.variants
-                )
-                tile_cache[hash(tile)] = final_tile
-            for variant in tile.variants:
-                # All non-post variants should've been weeded out by now
+                    blend(out[bounds], sprite)
+                # Shared between every tile that hits the cache, so it can't be touched
+                out.flags.writeable = False
+                self.tile_cache[key] = out
+            final_tile = ProcessedTile(
+                tile.name,
+                out,
+                tile.x,
+                tile.y,
+                tile.z,
+                [variant for variant in tile.variants if variant.type == "post"]
+            )
+            for variant in final_tile.variants:
                 await variant.call(final_tile)
             processed_tile_list.append(final_tile)
         return processed_tile_list
 
-    async def render(
+    @staticmethod
+    def opaque_pixels(sprite: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+        """If every pixel of a sprite is either fully opaque or fully transparent,
+        returns it with each pixel packed into a uint32, and where it's opaque."""
+        alpha = sprite[..., 3]
+        if not ((alpha == 0) | (alpha == 255)).all():
+            return None
+        return np.ascontiguousarray(sprite).view(np.uint32)[..., 0], *np.nonzero(alpha)
+
+    def composite(
             self,
-            tiles: list[ProcessedTile],
-            buf: BytesIO,
-            ctx: RenderingContext
-    ) -> None:
-        left, top, width, height = (
-            ctx.spacing / 2 * ctx.upscale,
-            ctx.spacing / 2 * ctx.upscale,
-            ctx.width * ctx.spacing * ctx.upscale,
-            ctx.height * ctx.spacing * ctx.upscale
-        )
+            image: np.ndarray,
+            draws: list[tuple[np.ndarray, int, int, str]],
+            cell: int,
+            origin: tuple[int, int],
+            opaque: dict[int, tuple[np.ndarray, np.ndarray, np.ndarray] | None]
+    ):
+        """Draws sprites in order.
+        Runs of binary alpha sprites that don't share any grid cells can't overlap, so their draw order
+        doesn't matter, and every copy of the same sprite in one is written at once."""
+        run: dict[int, tuple[np.ndarray, list[int], list[int]]] = {}
+        claimed: set[tuple[int, int]] = set()
+        # Binary alpha sprites are copied rather than blended, so each pixel can be moved as one uint32
+        pixels = image.view(np.uint32)[..., 0]
+        rows, columns = (image.shape[0] - origin[0]) // cell, (image.shape[1] - origin[1]) // cell
+        # The same pixels split into grid cells, indexed by [row, y, column, x]
+        grid = pixels[
+            origin[0]:origin[0] + rows * cell, origin[1]:origin[1] + columns * cell
+        ].reshape(rows, cell, columns, cell)
+
+        def flush():
+            for sprite, ys, xs in run.values():
+                packed, my, mx = opaque[id(sprite)]
+                ys, xs = np.array(ys) - origin[0], np.array(xs) - origin[1]
+                if (
+                        packed.shape == (cell, cell) and ys.min() >= 0 and xs.min() >= 0
+                        and not (ys % cell).any() and not (xs % cell).any()
+                ):
+                    # Strided write of whole cells
+                    ys, xs = ys // cell, xs // cell
+                    if len(my) == cell * cell:
+                        grid[ys, :, xs] = packed
+                    else:
+                        cells = grid[ys, :, xs]
+                        np.copyto(cells, packed, where=sprite[..., 3] > 0)
+                        grid[ys, :, xs] = cells
+                else:
+                    pixels[ys[:, np.newaxis] + my + origin[0], xs[:, np.newaxis] + mx + origin[1]] = packed[my, mx]
+            run.clear()
+            claimed.clear()
+
+        for sprite, y, x, mode in draws:
+            h, w = sprite.shape[:2]
+            if id(sprite) not in opaque:
+                opaque[id(sprite)] = self.opaque_pixels(sprite)
+            if (
+                    mode == "normal" and opaque[id(sprite)] is not None
+                    and 0 <= y and y + h <= image.shape[0] and 0 <= x and x + w <= image.shape[1]
+            ):
+                cells = {
+                    (cy, cx)
+                    for cy in range((y - origin[0]) // cell, (y - origin[0] + h - 1) // cell + 1)
+                    for cx in range((x - origin[1]) // cell, (x - origin[1] + w - 1) // cell + 1)
+                }
+                if not claimed.isdisjoint(cells):
+                    flush()
+                claimed |= cells
+                _, ys, xs = run.setdefault(id(sprite), (sprite, [], []))
+                ys.append(y)
+                xs.append(x)
+            else:
+                flush()
+                paste(image, sprite, y, x, mode)
+        flush()
+
+    def plan(self, tiles: list[ProcessedTile], ctx: RenderingContext) -> RenderPlan:
+        """Lays out processed tiles on a canvas, without changing them."""
+        cell = ctx.spacing * ctx.upscale
+        placed = []
         for tile in tiles:
             tile: ProcessedTile
+            scale = tile.scale[0] * ctx.upscale, tile.scale[1] * ctx.upscale
             h, w = tile.sprite.shape[:2]
-            rotation_scale = math.cos(math.radians(-tile.rotation % 90)) + math.sin(math.radians(-tile.rotation % 90))
-            tile.scale[0] *= ctx.upscale
-            tile.scale[1] *= ctx.upscale
-            w *= tile.scale[0] * rotation_scale
-            h *= tile.scale[1] * rotation_scale
-            tile.x *= ctx.spacing * ctx.upscale
-            tile.y *= ctx.spacing * ctx.upscale
-            left = max(left, w / 2 - tile.x)
-            top = max(top, h / 2 - tile.y)
-            width = max(width, left + tile.x + w / 2)
-            height = max(height, top + tile.y + h / 2)
+            w *= abs(scale[0]) * rotation_scale(tile.rotation)
+            h *= abs(scale[1]) * rotation_scale(tile.rotation)
+            placed.append((tile, tile.x * cell, tile.y * cell, w, h, scale))
+        # Make room for anything that sticks out past the top or left of the grid
+        left = max([cell / 2, *(w / 2 - x for _, x, _, w, _, _ in placed)])
+        top = max([cell / 2, *(h / 2 - y for _, _, y, _, h, _ in placed)])
+        width = max([ctx.width * cell, *(left + x + w / 2 for _, x, _, w, _, _ in placed)])
+        height = max([ctx.height * cell, *(top + y + h / 2 for _, _, y, _, h, _ in placed)])
         assert width <= MAX_SIZE[0] and height <= MAX_SIZE[1], f"ur img is to larg!! ({width, height} > {MAX_SIZE}"
-        image = np.zeros((int(math.ceil(height)), int(math.ceil(width)), 4), dtype=np.uint8)
-        image += np.array(ctx.bg, dtype=np.uint8)
-        for tile in sorted(tiles, key=lambda til: til.z):
-            tile: ProcessedTile
-            tile.x += left
-            tile.y += top
-
-            sprite = cv2.resize(tile.sprite, (0, 0), fx=tile.scale[0], fy=tile.scale[1],
-                                interpolation=cv2.INTER_NEAREST)
-
-            scale = math.cos(math.radians(-tile.rotation % 90)) + math.sin(math.radians(-tile.rotation % 90))
-            padding = math.floor(sprite.shape[0] * ((scale - 1) / 2)), math.floor(sprite.shape[1] * ((scale - 1) / 2))
-            sprite = np.pad(sprite, (padding, padding, (0, 0)))
+        return RenderPlan(
+            int(math.ceil(width)),
+            int(math.ceil(height)),
+            (int(top) - cell // 2, int(left) - cell // 2),
+            cell,
+            tuple(
+                Draw(tile.sprite, x + left, y + top, tile.rotation, scale, tile.blending, tile.wobble)
+                for tile, x, y, _, _, scale in sorted(placed, key=lambda place: place[0].z)
+            )
+        )
 
+    async def render(
+            self,
+            plan: RenderPlan,
+            buf: BytesIO,
+            ctx: RenderingContext
+    ) -> str:
+        """Renders a plan into a buffer, returning the format it was saved in."""
+        base = np.empty((plan.height, plan.width, 4), dtype=np.uint8)
+        base[...] = premultiply(np.array(ctx.bg, dtype=np.uint8))
+        draws = []
+        # Identical tiles get the same transformed sprite, so that they can be batched together
+        transformed = {}
+        for draw in plan.draws:
+            transform_key = id(draw.sprite), draw.rotation, draw.scale
+            if (sprite := transformed.get(transform_key)) is None:
+                sprite = transformed[transform_key] = transform(draw.sprite, draw.rotation, draw.scale)
             h, w = sprite.shape[:2]
-
-            center = w / 2, h / 2
-            matrix = cv2.getRotationMatrix2D(center, -tile.rotation, 1.)
-            sprite = cv2.warpAffine(sprite, matrix, (w, h), flags=cv2.INTER_NEAREST)
-            a, b = int(tile.y - h // 2), int(tile.x - w // 2)  # its 1am i can fix the var names later
-            image_slice = slice(a, a + sprite.shape[0]), slice(b, b+sprite.shape[1])
-            crop_shape = image[*image_slice].shape[:2]
-            image[*image_slice] = self.blend(image[*image_slice], sprite[:crop_shape[0], :crop_shape[1]], "normal")
-        Image.fromarray(image).save(buf, format="PNG")
+            draws.append((sprite, int(draw.y - h // 2), int(draw.x - w // 2), draw.blending, draw.wobble))
+        cell, origin = plan.cell, plan.origin
+        opaque = {}
+        # Everything under the first wobbling tile looks the same in every frame, so it's only drawn once
+        static = next((i for i, draw in enumerate(draws) if draw[4]), len(draws)) if ctx.frames > 1 else len(draws)
+        self.composite(base, [draw[:4] for draw in draws[:static]], cell, origin, opaque)
+        frames = []
+        for frame in range(ctx.frames):
+            image = base.copy() if static < len(draws) else base
+            # Seeded, so that the same render always wobbles the same way
+            offsets = np.random.default_rng(frame).integers(-1, 2, (len(draws), 2)) * ctx.upscale
+            self.composite(image, [
+                (sprite, y + dy, x + dx, mode) if wobble else (sprite, y, x, mode)
+                for (sprite, y, x, mode, wobble), (dy, dx) in zip(draws[static:], offsets[static:])
+            ], cell, origin, opaque)
+            frames.append(unpremultiply(image))
+        out, format = self.encoder.encode(frames, ctx.format)
+        buf.write(out)
         buf.seek(0)
+        return format
 
 
 async def setup(bot: Bot):
     bot.renderer = Renderer(bot)
+
+
+async def teardown(bot: Bot):
+    bot.db.reload_callbacks.remove(bot.renderer.on_reload)
+    bot.renderer.shutdown()
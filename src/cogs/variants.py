@@ -1,13 +1,14 @@
 import inspect
+import re
 import types
 import typing
 from re import Pattern
 from typing import Literal
 
-import cv2
-import numpy as np
 from discord.ext.commands import Cog
 
+from src import sprites
+from src.blending import BLEND_MODES
 from src.types import Bot, Variant, VariantList, ProcessedTile, Tile
 
 
@@ -61,6 +62,7 @@ class VariantCog(Cog):
                 {
                     "description": func.__doc__,
                     "syntax": syntax,
+                    "arguments": re.compile(self.get_pattern(signature)),
                     "signature": signature,
                     "call": lambda var_self, tile: self.call(var_self, tile),
                     "func": func,
@@ -68,7 +70,7 @@ class VariantCog(Cog):
                     "aliases": names
                 }
             )
-            self.bot.variants.append(var_class)
+            self.bot.variants.register(var_class)
             return func
         return inner
 
@@ -115,11 +117,10 @@ async def setup(bot: Bot):
     async def flip(tile, /, axis: str):
         """Flips a tile along an axis.
         `(axis: ("x","y"))`"""
-        assert axis in ('x', 'y'), f"bad varint proprtie `{axis}`!!"
-        slice_dict = {"x": (slice(None), slice(None, None, -1)), "y": (slice(None, None, -1))}
         tile: Tile
+        view = sprites.flip(axis)
         for i, sprite in enumerate(tile.sprites):
-            tile.sprites[i] = sprite[slice_dict[axis]]
+            tile.sprites[i] = sprite[view]
 
 
     @cog.add_variant("post")
@@ -148,38 +149,28 @@ async def setup(bot: Bot):
     @cog.add_variant("sprite")
     async def blank(tile, /):
         """Sets a tile to completely blank and removes all but one color layer."""
-        mask = np.zeros(np.amax([sprite.shape[:2] for sprite in tile.sprites], axis=0), dtype=bool)
-        for sprite in tile.sprites:
-            bounds = (
-                slice(int((mask.shape[0] - sprite.shape[0]) // 2), int(((mask.shape[0] + sprite.shape[0]) // 2))),
-                slice(int((mask.shape[1] - sprite.shape[1]) // 2), int(((mask.shape[1] + sprite.shape[1]) // 2)))
-            )
-            mask[bounds] |= sprite[..., 3] > 0
-        tile.sprites = [np.dstack((mask, mask, mask, mask)).astype(np.uint8) * 255]
+        tile.sprites = [sprites.mask_sprite(sprites.union_mask(tile.sprites))]
 
     @cog.add_variant("sprite")
     async def outline(tile, /, edges: bool | None = None):
         """Outlines the tile.
         `(edges: Optional[bool] = True)`"""
         if edges is None: edges = True
-        mask = np.zeros(np.amax([sprite.shape[:2] for sprite in tile.sprites], axis=0), dtype=bool)
-        for sprite in tile.sprites:
-            bounds = (
-                slice(int((mask.shape[0] - sprite.shape[0]) // 2), int(((mask.shape[0] + sprite.shape[0]) // 2))),
-                slice(int((mask.shape[1] - sprite.shape[1]) // 2), int(((mask.shape[1] + sprite.shape[1]) // 2)))
-            )
-            mask[bounds] |= sprite[..., 3] > 0
-        edges = int(edges)
-        kernel = np.array((
-            (edges, 1, edges),
-            (    1, 0, 1    ),
-            (edges, 1, edges)
-        ), dtype=float)
-        for i, sprite in enumerate(tile.sprites):
-            filtered_sprite = cv2.filter2D(src=sprite, ddepth=-1, kernel=kernel)
-            filtered_sprite = np.clip(filtered_sprite, 0, 255)
-            filtered_sprite[mask, 3] = 0
-            tile.sprites[i] = filtered_sprite
+        tile.sprites = sprites.outline_sprites(tile.sprites, sprites.union_mask(tile.sprites), edges)
+
+    @cog.add_variant("post", "m!")
+    async def blend(tile, /, mode: str):
+        """Sets how a tile blends with the tiles under it.
+        `(mode: ("normal", "multiply", "add", "screen", "subtract", "overlay"))`"""
+        assert mode in BLEND_MODES, f"wat is blenn mod `{mode}`??"
+        tile: ProcessedTile
+        tile.blending = mode
+
+    @cog.add_variant("post")
+    async def still(tile, /):
+        """Stops a tile from wobbling in animated renders."""
+        tile: ProcessedTile
+        tile.wobble = False
 
     @cog.add_variant("tile", "p!")
     async def palette(tile, /, pal: str):
@@ -197,11 +188,9 @@ async def setup(bot: Bot):
     async def crop(tile, /, x: int, y: int, u: int, v: int):
         """Crops the tile to a box.
         `(x: int, y: int, u: int, v: int)`"""
+        view = sprites.crop(x, y, u, v)
         for i, sprite in enumerate(tile.sprites):
-            try:
-                tile.sprites[i] = sprite[y:v, x:u]
-            except IndexError:
-                raise AssertionError(f"bad varint proprtie `{x, y, u, v}`!!")
+            tile.sprites[i] = sprite[view]
 
 
 
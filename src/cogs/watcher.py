@@ -0,0 +1,77 @@
+import asyncio
+import warnings
+from pathlib import Path
+
+from discord.ext import commands, tasks
+
+import config
+from src.types import Bot
+
+ASSETS = Path("data/bab/assets")
+
+
+class WatcherCog(commands.Cog, name="Watcher"):
+    """Reloads assets as their files change, touching only the ones that did."""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.mtimes: dict[Path, float] | None = None
+
+    async def cog_load(self):
+        # Bot.__init__ loads cogs on a loop of its own, which is closed before the bot runs,
+        # so the poll only starts here if the cog is reloaded while the bot is already up
+        if self.bot.is_ready():
+            self.start_polling()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Also restarts the poll if it died while the bot was running
+        self.start_polling()
+
+    def start_polling(self):
+        if config.asset_poll_interval is None or self.poll.is_running():
+            return
+        if self.poll.get_task() is not None:
+            warnings.warn("The asset watcher stopped, restarting it")
+        self.poll.change_interval(seconds=config.asset_poll_interval)
+        self.poll.start()
+
+    async def cog_unload(self):
+        self.poll.cancel()
+
+    @staticmethod
+    def scan() -> dict[Path, float]:
+        return {path: path.stat().st_mtime for path in ASSETS.rglob("*.*") if path.is_file()}
+
+    @tasks.loop(seconds=5)
+    async def poll(self):
+        # The database connects in on_ready, after this starts
+        if getattr(self.bot.db, "path", None) is None:
+            return
+        # Walking every asset blocks for too long to do on the event loop
+        mtimes = await asyncio.to_thread(self.scan)
+        if self.mtimes is None:
+            self.mtimes = mtimes
+            return
+        changed = {path for path in mtimes.keys() | self.mtimes.keys() if mtimes.get(path) != self.mtimes.get(path)}
+        self.mtimes = mtimes
+        if not len(changed):
+            return
+        palettes, overlays, tiles = [], [], False
+        for path in changed:
+            if path.parent == ASSETS / "palettes":
+                palettes.append(path.stem)
+            elif path.parent == ASSETS / "sprites" / "overlay":
+                overlays.append(path.stem)
+            elif path.is_relative_to(ASSETS / "tiles") or path.is_relative_to(ASSETS / "sprites"):
+                tiles = True
+        if len(palettes):
+            await self.bot.db.load_palettes(palettes)
+        if len(overlays):
+            await self.bot.db.load_overlays(overlays)
+        if tiles and len(names := await self.bot.db.ingest_tiles()):
+            await self.bot.db.load_tiles(names=names)
+
+
+async def setup(bot: Bot):
+    await bot.add_cog(WatcherCog(bot))
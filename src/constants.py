@@ -2,4 +2,22 @@ import discord
 
 TILE_SIZE = 32
 MAX_SIZE = (2048, 2048)
+MAX_FRAMES = 8
+# In milliseconds
+FRAME_DURATION = 200
+# Discord's upload limit, in bytes
+MAX_FILE_SIZE = 10 * 1000 * 1000
+# In bytes
+TILE_CACHE_SIZE = 64 * 2 ** 20
+RECOLOR_CACHE_SIZE = 32 * 2 ** 20
+# Decoded tile sprites
+SPRITE_CACHE_SIZE = 128 * 2 ** 20
+# Finished renders, kept on disk
+RENDER_CACHE_SIZE = 256 * 2 ** 20
+# How many asset changes the render workers can fall behind by before they're restarted
+MAX_PENDING_CHANGES = 64
+# Distinct tiles, as written in grids, to remember the parsing of
+PARSED_TILE_CACHE_SIZE = 4096
+# Distinct chains of sprite variants to keep compiled
+SPRITE_CHAIN_CACHE_SIZE = 1024
 TESTING_GUILD = discord.Object(586337032876589075)
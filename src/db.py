@@ -1,33 +1,205 @@
+import asyncio
+import hashlib
 import json
+import multiprocessing
+import os
 import re
+import sqlite3
 import struct
+import time
 import warnings
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from io import BytesIO
 from pathlib import Path
-from luaparser import ast
+from typing import Callable, Any
 
 import asqlite
 import numpy as np
 from PIL import Image
 
+import config
+from src import mapparser
+from src.cache import LRUCache
+from src.constants import RENDER_CACHE_SIZE, SPRITE_CACHE_SIZE
+from src.names import NameIndex
 from src.types import TileData, Bot, LevelData
 
 
+def split_sprites(raw: bytes) -> list[tuple[int, int]]:
+    """Finds where each PNG in a length-prefixed sprite blob starts and ends, without decoding them."""
+    spans = []
+    i = 0
+    while i < len(raw):
+        length, = struct.unpack_from("<L", raw, i)
+        spans.append((i + 4, i + 4 + length))
+        i += 4 + length
+    return spans
+
+
+def decode_sprites(raw: bytes, spans: list[tuple[int, int]]) -> list[np.ndarray]:
+    sprites = []
+    for start, end in spans:
+        with BytesIO(raw[start:end]) as buf:
+            with Image.open(buf) as im:
+                sprite = np.array(im.convert("RGBA"), dtype=np.uint8)
+        sprite.flags.writeable = False
+        sprites.append(sprite)
+    return sprites
+
+
+def write_atlas(path: Path, jobs: list[tuple[str, bool, bytes, list[tuple[int, int]]]], atlas: dict[tuple[str, bool], list[np.ndarray]]):
+    """Writes a sprite atlas one tile at a time, so that only one tile's sprites are decoded at once.
+    Tiles that are up-to-date in the current atlas are copied from it instead."""
+    index = []
+    temp_path = path.with_suffix(".tmp")
+    with open(temp_path, "wb") as f:
+        # The index goes last, since where each sprite goes isn't known until it's decoded
+        f.write(struct.pack("<8sQ", ATLAS_MAGIC, 0))
+        for name, slep, raw, spans in jobs:
+            sprites = atlas.get((name, slep))
+            if sprites is None:
+                sprites = decode_sprites(raw, spans)
+            offsets = []
+            for sprite in sprites:
+                offsets.append(f.tell() - 16)
+                f.write(np.ascontiguousarray(sprite).data)
+            index.append({
+                "name": name,
+                "slep": slep,
+                "crc": zlib.crc32(raw),
+                "sprites": offsets,
+                "shapes": [sprite.shape[:2] for sprite in sprites]
+            })
+        index_offset = f.tell()
+        f.write(json.dumps(index, separators=(",", ":")).encode("utf-8"))
+        f.seek(0)
+        f.write(struct.pack("<8sQ", ATLAS_MAGIC, index_offset))
+    # Anything that has the old atlas mapped keeps seeing the old file
+    os.replace(temp_path, path)
+
+
+def read_worlds() -> tuple[list[Path], list[tuple[Path, Path, str, bytes]]]:
+    """Reads every official level, along with the world it's in and its hash."""
+    worlds = list(Path("data/bab/officialworlds/").glob("*/"))
+    levels = []
+    for world in worlds:
+        for level in world.glob("**/*.bab"):
+            with open(level, "rb") as f:
+                raw = f.read()
+            levels.append((world, level, hashlib.sha256(raw).hexdigest(), raw))
+    return worlds, levels
+
+
+def read_tiles() -> list[tuple[dict[str, Any], float]]:
+    """Reads every tile from the assets, along with when the file it's in was last modified."""
+    tiles = []
+    for path in Path("data/bab/assets/tiles").glob("*/*.json"):
+        mtime = path.stat().st_mtime
+        with open(path, "r") as f:
+            tiles.extend((tile, mtime) for tile in json.load(f))
+    return tiles
+
+
+def pack_tile(tile: dict[str, Any], mtime: float, previous: tuple[str, float] | None) -> tuple | None:
+    """Reads a tile's sprites from the assets and packs them into a row of the tiles table.
+
+    Returns None if none of the tile's files were modified since it was last packed,
+    or its hash, mtime and row otherwise. The row is None if the files were modified, but their contents weren't."""
+    sprite_root = Path("data/bab/assets/sprites")
+    paths = []
+    for sprite_path in tile["sprite"]:
+        paths.append(((sprite_root / sprite_path).with_suffix(".png"), False))
+        paths.append(((sprite_root / (sprite_path + "_slep")).with_suffix(".png"), True))
+    for path, _ in paths:
+        try:
+            mtime = max(mtime, path.stat().st_mtime)
+        except FileNotFoundError:
+            pass
+    if previous is not None and previous[1] == mtime:
+        return None
+    digest = hashlib.sha256(json.dumps(tile, sort_keys=True).encode("utf-8"))
+    # Create a linked list of sprites
+    sprites, sleep_sprites = bytearray(), bytearray()
+    for path, slep in paths:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            if not slep:
+                warnings.warn(f"Can't find sprite {path}")
+            continue
+        digest.update(data)
+        buf = sleep_sprites if slep else sprites
+        buf += struct.pack("<L", len(data))
+        buf += data
+    digest = digest.hexdigest()
+    if previous is not None and previous[0] == digest:
+        return digest, mtime, None
+    col = " ".join(",".join(str(n) for n in col) for col in tile["color"])
+    painted = " ".join([
+        (str(int(paint)) if type(paint) is bool else ",".join(str(n) for n in paint))
+        for paint in tile["painted"]
+    ]) if "painted" in tile else None
+    return digest, mtime, (
+        tile["name"], col, bytes(sprites), bytes(sleep_sprites) if len(sleep_sprites) else None,
+        painted, tile.get("rotate", False), tile.get("layer", None)
+    )
+
+
+def tune(conn: sqlite3.Connection):
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {256 * 2 ** 20}")
+    # Negative sizes are in KiB
+    conn.execute(f"PRAGMA cache_size = {-32 * 2 ** 10}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA busy_timeout = 5000")
+
+
+ATLAS_MAGIC = b"RBATLAS2"
+
+
 class Database:
-    conn: asqlite.Connection
+    # None if connected read-only
+    conn: asqlite.Connection | None = None
+    readers: asqlite.Pool
     bot: Bot
+    path: str
     tiles: dict[str, TileData] = {}
     palettes: dict[str, np.ndarray] = {}
     overlays: dict[str, np.ndarray] = {}
     worlds: dict[str, dict[str, LevelData]] = {}
     level_names: dict[str, str] = {}
+    # For autocomplete, rebuilt whenever what they index is reloaded
+    tile_index: NameIndex = NameIndex()
+    palette_index: NameIndex = NameIndex()
+    level_index: NameIndex = NameIndex()
+    # Content hashes of every asset, keyed by its kind and name
+    asset_hashes: dict[tuple[str, str], str] = {}
+    reload_callbacks: list[Callable[[str, list[str] | None], Any]]
+    sprite_cache: LRUCache
+    # Views into the memory-mapped sprite atlas, for every tile it has up-to-date sprites for
+    atlas: dict[tuple[str, bool], list[np.ndarray]] = {}
 
     def __init__(self, bot):
         self.bot = bot
+        self.reload_callbacks = []
+        self.asset_hashes = {}
+        # Everything stays decoded if it's all preloaded anyway
+        self.sprite_cache = LRUCache(None if config.preload_sprites else SPRITE_CACHE_SIZE, sizeof=lambda sprites: sum(sprite.nbytes for sprite in sprites))
 
-    async def connect(self, db: str):
-        self.conn = await asqlite.connect(db)
-        await self.create_tables()
+    async def connect(self, db: str, readonly: bool = False):
+        """Connects to the database and loads the assets from it.
+        Read-only connections, which the render workers use, only get one reader and can't write."""
+        self.path = db
+        # One connection writes, and the rest only read, so that reads never wait on writes.
+        # asqlite already puts the database in WAL mode, which is what lets them run at the same time.
+        if not readonly:
+            self.conn = await asqlite.connect(db, init=tune)
+            await self.create_tables()
+        self.readers = await asqlite.create_pool(
+            f"{Path(db).resolve().as_uri()}?mode=ro", uri=True, size=1 if readonly else config.db_readers, init=tune
+        )
         await self.load()
 
     async def load(self):
@@ -35,70 +207,266 @@ class Database:
         await self.load_palettes()
         await self.load_overlays()
 
-    async def load_tiles(self, *, flush: bool = False):
+    async def reload(self, kind: str, names: list[str] | None = None):
+        """Reloads some or all assets of a kind."""
+        if kind == "tiles":
+            await self.load_tiles(names=names)
+        elif kind == "palettes":
+            await self.load_palettes(names)
+        elif kind == "overlays":
+            await self.load_overlays(names)
+
+    async def load_tiles(self, *, flush: bool = False, names: list[str] | None = None):
+        """Loads tiles from the database. If names are given, only those are reloaded."""
         if flush: self.tiles = {}
-        async with self.conn.cursor() as cur:
-            await cur.execute("SELECT * FROM tiles")
+        async with self.readers.acquire() as reader, reader.cursor() as cur:
+            if names is None:
+                self.sprite_cache.clear()
+                await cur.execute("SELECT * FROM tiles")
+            else:
+                for name in names:
+                    self.tiles.pop(name, None)
+                    self.asset_hashes.pop(("tiles", name), None)
+                    for slep in (False, True):
+                        self.sprite_cache.pop((name, slep))
+                        self.atlas.pop((name, slep), None)
+                await cur.execute(f"SELECT * FROM tiles WHERE name IN ({', '.join('?' * len(names))})", *names)
             for (name, colors, raw_sprites, raw_slep_sprites, painted, rotate, layer) in await cur.fetchall():
+                digest = hashlib.sha256(f"{colors}|{painted}|{rotate}|{layer}|".encode("utf-8"))
+                digest.update(raw_sprites)
+                digest.update(raw_slep_sprites or b"")
+                self.asset_hashes["tiles", name] = digest.hexdigest()
                 colors = [[int(n) for n in color.split(",")] for color in colors.split(" ")]
                 painted = [
                     [int(n) for n in paint.split(",")] if "," in paint else bool(int(paint))
                     for paint in painted.split(" ")
                 ] if painted is not None else [True for _ in range(len(colors))]
-                sprites = []
-                with BytesIO(raw_sprites) as buf:
-                    while len(next_loc := buf.read(4)):
-                        seek_length, = struct.unpack("<L", next_loc)
-                        image_data = buf.read(seek_length)
-                        with BytesIO(image_data) as image_buf:
-                            with Image.open(image_buf) as im:
-                                sprites.append(np.array(im.convert("RGBA"), dtype=np.uint8))
-                if not len(sprites):
+                sprite_spans = split_sprites(raw_sprites)
+                if not len(sprite_spans):
                     warnings.warn(f"Tile {name} is invalid")
                     continue
-                slep_sprites = None
-                if raw_slep_sprites is not None:
-                    slep_sprites = []
-                    with BytesIO(raw_slep_sprites) as buf:
-                        while len(next_loc := buf.read(4)):
-                            seek_length, = struct.unpack("<L", next_loc)
-                            image_data = buf.read(seek_length)
-                            with BytesIO(image_data) as image_buf:
-                                with Image.open(image_buf) as im:
-                                    slep_sprites.append(np.array(im.convert("RGBA"), dtype=np.uint8))
-                self.tiles[name] = TileData(colors, sprites, slep_sprites, painted, rotate, layer)
-
-    async def load_palettes(self):
-        self.palettes = {}
-        for pal in Path("data/bab/assets/palettes").glob("*.png"):
-            with Image.open(pal) as im:
-                self.palettes[pal.stem] = np.array(im.convert("RGBA"), dtype=np.uint8)
-
-    async def load_overlays(self):
-        self.overlays = {}
-        for ov in Path("data/bab/assets/sprites/overlay").glob("*.png"):
-            with Image.open(ov) as im:
-                self.overlays[ov.stem] = np.array(im.convert("RGBA"), dtype=np.uint8).astype(float) / 255
+                slep_spans = split_sprites(raw_slep_sprites) if raw_slep_sprites is not None else None
+                self.tiles[name] = TileData(
+                    colors, raw_sprites, sprite_spans, raw_slep_sprites, slep_spans, painted, rotate, layer
+                )
+        if names is None:
+            self.load_atlas()
+        warm = self.tiles if config.preload_sprites else config.warm_tiles
+        for key, sprites in (await self.decode_tiles([
+            name for name in (warm if names is None else names)
+            if name in self.tiles and name in warm and (name, False) not in self.atlas
+        ])).items():
+            self.sprite_cache[key] = sprites
+        self.reloaded("tiles", names)
 
-    async def load_worlds(self):
-        self.worlds = {}
-        self.level_names = {}
-        for world in Path("data/bab/officialworlds/").glob("*/"):
-            world_name = world.stem
-            self.worlds[world_name] = {}
-            for level in world.glob("**/*.bab"):
-                with open(level, "r") as f:
-                    raw_level_data = json.load(f)
-                    level_data = LevelData.from_json(raw_level_data, self.bot)
-                    if level_data is not None:
-                        self.worlds[world_name][str(level)[len(str(world))+1:]] = level_data
-                        self.level_names[level_data.name] = level_data
+    async def ingest_tiles(self) -> list[str]:
+        """Reads tiles from the assets into the database, skipping any whose files haven't changed since.
+        Returns the names of the tiles that were added, changed or removed."""
+        async with self.readers.acquire() as reader, reader.cursor() as cur:
+            await cur.execute("SELECT name, hash, mtime FROM tile_hashes")
+            previous = {name: (digest, mtime) for name, digest, mtime in await cur.fetchall()}
+            await cur.execute("SELECT name FROM tiles")
+            stored = {name for name, in await cur.fetchall()}
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor() as pool:
+            tiles = await loop.run_in_executor(pool, read_tiles)
+            packed = await asyncio.gather(*(
+                loop.run_in_executor(pool, pack_tile, tile, mtime, previous.get(tile["name"]))
+                for tile, mtime in tiles
+            ))
+        hashes = [(tile["name"], *result[:2]) for (tile, _), result in zip(tiles, packed) if result is not None]
+        rows = [result[2] for result in packed if result is not None and result[2] is not None]
+        names = {tile["name"] for tile, _ in tiles}
+        removed = [(name,) for name in stored | previous.keys() if name not in names]
+        async with self.conn.transaction():
+            await self.conn.executemany("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            await self.conn.executemany("INSERT OR REPLACE INTO tile_hashes VALUES (?, ?, ?)", hashes)
+            await self.conn.executemany("DELETE FROM tiles WHERE name = ?", removed)
+            await self.conn.executemany("DELETE FROM tile_hashes WHERE name = ?", removed)
+        return [row[0] for row in rows] + [name for name, in removed]
+
+    def sprite_blob(self, name: str, slep: bool) -> tuple[bytes, list[tuple[int, int]]]:
+        tile_data = self.tiles[name]
+        if slep:
+            return tile_data.raw_slep_sprites, tile_data.slep_spans
+        return tile_data.raw_sprites, tile_data.sprite_spans
 
+    def sprites(self, name: str, slep: bool = False) -> list[np.ndarray]:
+        """Gets the sprites of a tile, decoding them the first time they're needed.
+        They're shared between every render, so they're read-only."""
+        if slep and self.tiles[name].raw_slep_sprites is None:
+            slep = False
+        if (sprites := self.atlas.get((name, slep))) is not None:
+            return sprites
+        if (sprites := self.sprite_cache.get((name, slep))) is None:
+            sprites = decode_sprites(*self.sprite_blob(name, slep))
+            self.sprite_cache[name, slep] = sprites
+        return sprites
 
+    async def decode_tiles(self, names: list[str]) -> dict[tuple[str, bool], list[np.ndarray]]:
+        """Decodes the sprites and sleep sprites of many tiles at once, spread across threads.
+        Pillow lets go of the GIL while it decodes, so this scales with cores."""
+        jobs = [(name, False) for name in names]
+        jobs += [(name, True) for name in names if self.tiles[name].raw_slep_sprites is not None]
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor() as pool:
+            decoded = await asyncio.gather(*(
+                loop.run_in_executor(pool, decode_sprites, *self.sprite_blob(name, slep))
+                for name, slep in jobs
+            ))
+        return dict(zip(jobs, decoded))
 
+    def atlas_path(self) -> Path:
+        return Path(self.path).with_name("atlas.bin")
+
+    async def build_atlas(self):
+        """Packs every tile's decoded sprites into one file, so that processes can map it instead of decoding.
+
+        The file is ATLAS_MAGIC, where the index starts, raw RGBA pixels, and then the index as JSON.
+        Each index entry has a checksum of the blob it was decoded from, so that stale entries get ignored."""
+        jobs = [(name, slep, *self.sprite_blob(name, slep)) for name in self.tiles for slep in (False, True)]
+        jobs = [job for job in jobs if job[2] is not None]
+        await asyncio.to_thread(write_atlas, self.atlas_path(), jobs, dict(self.atlas))
+        self.load_atlas()
+
+    def load_atlas(self):
+        self.atlas = {}
+        path = self.atlas_path()
+        if not path.exists():
+            return
+        with open(path, "rb") as f:
+            magic, index_offset = struct.unpack("<8sQ", f.read(16))
+            if magic != ATLAS_MAGIC:
+                warnings.warn(f"{path} isn't a sprite atlas")
+                return
+            f.seek(index_offset)
+            index = json.loads(f.read())
+        if index_offset == 16:
+            return
+        data = np.memmap(path, dtype=np.uint8, mode="r", offset=16, shape=(index_offset - 16,))
+        for entry in index:
+            name, slep = entry["name"], entry["slep"]
+            if name not in self.tiles:
+                continue
+            raw, _ = self.sprite_blob(name, slep)
+            if raw is None or zlib.crc32(raw) != entry["crc"]:
+                continue
+            self.atlas[name, slep] = [
+                data[offset:offset + h * w * 4].reshape(h, w, 4)
+                for offset, (h, w) in zip(entry["sprites"], entry["shapes"])
+            ]
+
+    def load_images(
+            self, kind: str, assets: dict[str, np.ndarray], root: Path, names: list[str] | None
+    ) -> dict[str, np.ndarray]:
+        """Loads images from a folder of assets. If names are given, only those are reloaded."""
+        if names is None:
+            assets = {}
+            self.asset_hashes = {key: value for key, value in self.asset_hashes.items() if key[0] != kind}
+            paths = list(root.glob("*.png"))
+        else:
+            assets = assets.copy()
+            paths = [root / f"{name}.png" for name in names]
+        for path in paths:
+            self.asset_hashes.pop((kind, path.stem), None)
+            assets.pop(path.stem, None)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            self.asset_hashes[kind, path.stem] = hashlib.sha256(data).hexdigest()
+            with Image.open(BytesIO(data)) as im:
+                assets[path.stem] = np.array(im.convert("RGBA"), dtype=np.uint8)
+        return assets
+
+    async def load_palettes(self, names: list[str] | None = None):
+        self.palettes = self.load_images("palettes", self.palettes, Path("data/bab/assets/palettes"), names)
+        self.reloaded("palettes", names)
+
+    async def load_overlays(self, names: list[str] | None = None):
+        self.overlays = self.load_images("overlays", self.overlays, Path("data/bab/assets/sprites/overlay"), names)
+        self.reloaded("overlays", names)
+
+    def reloaded(self, kind: str, names: list[str] | None = None):
+        """Lets anything that derives data from the assets know that they changed.
+        If names are given, only those assets changed."""
+        if kind == "tiles":
+            self.tile_index = NameIndex(self.tiles)
+        elif kind == "palettes":
+            self.palette_index = NameIndex(self.palettes)
+        for callback in self.reload_callbacks:
+            callback(kind, names)
+
+    async def cached_render(self, key: str) -> tuple[bytes, str] | None:
+        async with self.readers.acquire() as reader, reader.cursor() as cur:
+            await cur.execute("SELECT data, format FROM renders WHERE key = ?", key)
+            if (row := await cur.fetchone()) is None:
+                return None
+        await self.conn.execute("UPDATE renders SET last_used = ? WHERE key = ?", time.time(), key)
+        return bytes(row[0]), row[1]
+
+    async def cache_render(self, key: str, data: bytes, format: str):
+        if len(data) > RENDER_CACHE_SIZE:
+            return
+        async with self.conn.cursor() as cur:
+            await cur.execute(
+                "INSERT OR REPLACE INTO renders VALUES (?, ?, ?, ?, ?)",
+                key, data, format, len(data), time.time()
+            )
+            # Evicts the least recently used renders until everything left fits
+            await cur.execute("""
+                DELETE FROM renders WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY last_used DESC) AS total FROM renders
+                    ) WHERE total > ?
+                )
+            """, RENDER_CACHE_SIZE)
+
+    async def load_worlds(self):
+        self.level_names = {}
+        async with self.readers.acquire() as reader, reader.cursor() as cur:
+            await cur.execute("SELECT path, hash, meta, tiles FROM levels")
+            cached = {path: (digest, meta, tiles) for path, digest, meta, tiles in await cur.fetchall()}
+        worlds, levels = await asyncio.to_thread(read_worlds)
+        self.worlds = {world.stem: {} for world in worlds}
+        # Only levels that are new or changed since they were last cached get parsed
+        stale = [(str(level), digest, raw) for _, level, digest, raw in levels if cached.get(str(level), (None,))[0] != digest]
+        if len(stale):
+            loop = asyncio.get_running_loop()
+            with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as pool:
+                parsed = await asyncio.gather(*(
+                    loop.run_in_executor(pool, mapparser.parse_level_file, raw) for _, _, raw in stale
+                ), return_exceptions=True)
+            # Levels that fail to parse are cached as such, so one bad level doesn't stop the rest from loading
+            rows = [
+                (path, digest, None, None) if result is None or isinstance(result, BaseException) else
+                (path, digest, json.dumps(result[0]), zlib.compress(json.dumps(result[1]).encode("utf-8")))
+                for (path, digest, _), result in zip(stale, parsed)
+            ]
+            cached.update((path, row) for path, *row in rows)
+        else:
+            rows = []
+        paths = {str(level) for _, level, _, _ in levels}
+        removed = [(path,) for path in cached if path not in paths]
+        async with self.conn.transaction():
+            await self.conn.executemany("INSERT OR REPLACE INTO levels VALUES (?, ?, ?, ?)", rows)
+            await self.conn.executemany("DELETE FROM levels WHERE path = ?", removed)
+        for world, level, _, _ in levels:
+            _, meta, tiles = cached[str(level)]
+            if meta is None:
+                warnings.warn(f"Could not parse {level}")
+                continue
+            level_data = LevelData.from_records(json.loads(meta), json.loads(zlib.decompress(tiles)), self.bot)
+            if level_data is not None:
+                self.worlds[world.stem][str(level)[len(str(world))+1:]] = level_data
+                self.level_names[level_data.name] = level_data
+        self.level_index = NameIndex(self.level_names)
 
     async def close(self):
-        await self.conn.close()
+        await self.readers.close()
+        if self.conn is not None:
+            await self.conn.close()
 
     async def create_tables(self):
         async with self.conn.cursor() as cur:
@@ -113,3 +481,31 @@ class Database:
                 z_index INTEGER
             ) WITHOUT ROWID;
             """)
+            # What each tile's assets looked like the last time they were read, so unchanged ones can be skipped
+            await cur.execute("""
+            CREATE TABLE IF NOT EXISTS tile_hashes (
+                name TEXT PRIMARY KEY NOT NULL,
+                hash TEXT NOT NULL,
+                mtime REAL NOT NULL
+            ) WITHOUT ROWID;
+            """)
+            # Parsed levels, so that only new or changed ones need to be parsed again
+            await cur.execute("""
+            CREATE TABLE IF NOT EXISTS levels (
+                path TEXT PRIMARY KEY NOT NULL,
+                hash TEXT NOT NULL,
+                meta TEXT,
+                tiles BLOB
+            ) WITHOUT ROWID;
+            """)
+            # Finished renders, keyed by a hash of everything that went into them
+            await cur.execute("""
+            CREATE TABLE IF NOT EXISTS renders (
+                key TEXT PRIMARY KEY NOT NULL,
+                data BLOB NOT NULL,
+                format TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            """)
+            await cur.execute("CREATE INDEX IF NOT EXISTS renders_last_used ON renders (last_used)")
@@ -0,0 +1,96 @@
+import time
+from io import BytesIO
+from typing import Callable
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import config
+from src.constants import MAX_FILE_SIZE, FRAME_DURATION
+
+
+def quantize(image: np.ndarray) -> Image.Image | None:
+    """Losslessly converts an image to palette mode, if it has few enough colors to allow it."""
+    im = Image.fromarray(image)
+    colors = im.getcolors(256)
+    if colors is None:
+        return None
+    keys = np.ascontiguousarray(image).view(np.uint32)[..., 0]
+    palette = np.unique(np.array([color for _, color in colors], dtype=np.uint8).view(np.uint32)[:, 0])
+    out = Image.fromarray(np.searchsorted(palette, keys).astype(np.uint8), mode="P")
+    out.putpalette(palette.view(np.uint8).tobytes(), rawmode="RGBA")
+    return out
+
+
+def pillow_encode(image: np.ndarray, format: str, level: int) -> bytes:
+    with BytesIO() as buf:
+        if format == "png":
+            Image.fromarray(image).save(buf, format="PNG", compress_level=level)
+        else:
+            Image.fromarray(image).save(buf, format="WEBP", lossless=True, method=round(level * 6 / 9))
+        return buf.getvalue()
+
+
+def cv2_encode(image: np.ndarray, format: str, level: int) -> bytes:
+    params = [cv2.IMWRITE_PNG_COMPRESSION, level] if format == "png" else [cv2.IMWRITE_WEBP_QUALITY, 101]
+    success, out = cv2.imencode(f".{format}", cv2.cvtColor(image, cv2.COLOR_RGBA2BGRA), params)
+    assert success, "cudnt sav ur img!!"
+    return out.tobytes()
+
+
+class Encoder:
+    """Turns rendered frames into a file, trading speed for size only when it has to."""
+    backends: dict[str, Callable[[np.ndarray, str, int], bytes]] = {
+        "pillow": pillow_encode,
+        "cv2": cv2_encode
+    }
+
+    def __init__(self):
+        # Seconds per pixel, for each format and backend
+        self.timings: dict[tuple[str, str], float] = {}
+
+    def fastest(self, format: str) -> str:
+        for backend in self.backends:
+            # Every backend gets measured once before picking
+            if (format, backend) not in self.timings:
+                return backend
+        return min(self.backends, key=lambda backend: self.timings[format, backend])
+
+    def encode_still(self, image: np.ndarray, format: str, level: int) -> bytes:
+        backend = self.fastest(format)
+        start = time.perf_counter()
+        out = self.backends[backend](image, format, level)
+        elapsed = (time.perf_counter() - start) / (image.shape[0] * image.shape[1])
+        previous = self.timings.get((format, backend), elapsed)
+        self.timings[format, backend] = previous * 0.8 + elapsed * 0.2
+        return out
+
+    def attempts(self, frames: list[np.ndarray], format: str):
+        """Yields encodings of the frames and their formats, each smaller and slower than the last."""
+        if len(frames) == 1 and format in ("png", "webp"):
+            if format == "png" and (im := quantize(frames[0])) is not None:
+                with BytesIO() as buf:
+                    im.save(buf, format="PNG", compress_level=config.png_compression)
+                    yield buf.getvalue(), format
+            yield self.encode_still(frames[0], format, config.png_compression), format
+            yield self.encode_still(frames[0], format, 9), format
+            if format != "webp":
+                yield self.encode_still(frames[0], "webp", 9), "webp"
+            return
+        images = [Image.fromarray(frame) for frame in frames]
+        for level in (config.png_compression, 9):
+            with BytesIO() as buf:
+                images[0].save(
+                    buf, format=format.upper(), save_all=len(images) > 1, append_images=images[1:],
+                    duration=FRAME_DURATION, loop=0, disposal=2 if format == "gif" else 0,
+                    compress_level=level, lossless=True, method=round(level * 6 / 9)
+                )
+                yield buf.getvalue(), format
+
+    def encode(self, frames: list[np.ndarray], format: str) -> tuple[bytes, str]:
+        """Encodes frames in a format, or another one if that's the only way to fit them under the upload limit."""
+        for out, out_format in self.attempts(frames, format):
+            if len(out) <= MAX_FILE_SIZE:
+                return out, out_format
+        raise AssertionError(f"ur img is to larg!! ({len(out)} bytes > {MAX_FILE_SIZE})")
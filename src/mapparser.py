@@ -0,0 +1,223 @@
+import base64
+import json
+import re
+import zlib
+from typing import Any
+
+# Parses the `map` field of .bab levels, which is a table dumped by Serpent:
+#   do local _={{dir=1,tile="bab",x=0,y=0},...};return _;end
+# Only table literals made of strings, numbers and nil are understood here.
+# Anything else falls back to parsing it as Lua.
+
+_TOKEN = re.compile(rb"""
+    \s*(?:
+        (?P<punct>[{}=,;\[\]])
+      | "(?P<dstring>(?:[^"\\\n]|\\.)*)"
+      | '(?P<sstring>(?:[^'\\\n]|\\.)*)'
+      | (?P<number>-?(?:0[xX][\da-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?))
+      | (?P<name>[A-Za-z_]\w*)
+    )
+""", re.VERBOSE | re.DOTALL)
+
+_ESCAPES = {b"n": b"\n", b"t": b"\t", b"r": b"\r", b"a": b"\a", b"b": b"\b", b"f": b"\f", b"v": b"\v"}
+_ESCAPE = re.compile(rb"\\(\d{1,3}|.)", re.DOTALL)
+
+
+class MapSyntaxError(ValueError):
+    """Raised for maps that aren't in the format this parser understands."""
+
+
+def _unescape(match: re.Match) -> bytes:
+    escape = match.group(1)
+    if escape.isdigit():
+        return bytes((int(escape),))
+    if escape in _ESCAPES:
+        return _ESCAPES[escape]
+    if escape in (b"\\", b'"', b"'", b"\n"):
+        return escape
+    raise MapSyntaxError(f"Unsupported escape \\{escape.decode('utf-8', 'replace')}")
+
+
+def _tokenize(raw: bytes) -> list[tuple[str, Any]]:
+    tokens = []
+    end = 0
+    for match in _TOKEN.finditer(raw):
+        if match.start() != end:
+            raise MapSyntaxError(f"Unexpected {raw[end:end + 16]!r} at {end}")
+        end = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "punct":
+            tokens.append((value.decode("ascii"), None))
+        elif kind == "number":
+            if value.lstrip(b"-")[:2] in (b"0x", b"0X"):
+                tokens.append(("value", int(value, 16)))
+            elif any(c in value for c in b".eE"):
+                tokens.append(("value", float(value)))
+            else:
+                tokens.append(("value", int(value)))
+        elif kind == "name":
+            if value == b"nil":
+                tokens.append(("value", None))
+            else:
+                tokens.append(("name", value.decode("ascii")))
+        else:
+            if b"\\" in value:
+                value = _ESCAPE.sub(_unescape, value)
+            tokens.append(("value", value.decode("utf-8")))
+    if raw[end:].strip():
+        raise MapSyntaxError(f"Unexpected {raw[end:end + 16]!r} at {end}")
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens: list[tuple[str, Any]]):
+        self.tokens = tokens
+        self.i = 0
+
+    def next(self) -> tuple[str, Any]:
+        try:
+            token = self.tokens[self.i]
+        except IndexError:
+            raise MapSyntaxError("Unexpected end of map")
+        self.i += 1
+        return token
+
+    def expect(self, kind: str, value: Any = None) -> Any:
+        token_kind, token_value = self.next()
+        if token_kind != kind or (value is not None and token_value != value):
+            raise MapSyntaxError(f"Expected {value or kind}, got {token_value or token_kind}")
+        return token_value
+
+    def skip(self, kind: str) -> bool:
+        if self.i < len(self.tokens) and self.tokens[self.i][0] == kind:
+            self.i += 1
+            return True
+        return False
+
+    def value(self) -> Any:
+        kind, value = self.next()
+        if kind == "value":
+            return value
+        if kind == "{":
+            return self.table()
+        raise MapSyntaxError(f"Expected a value, got {value or kind}")
+
+    def table(self) -> list | dict:
+        fields = {}
+        index = 1
+        while not self.skip("}"):
+            if self.skip("["):
+                key = self.value()
+                self.expect("]")
+                self.expect("=")
+            elif [kind for kind, _ in self.tokens[self.i:self.i + 2]] == ["name", "="]:
+                key = self.next()[1]
+                self.i += 1
+            else:
+                key = index
+                index += 1
+            fields[key] = self.value()
+            if not (self.skip(",") or self.skip(";")):
+                self.expect("}")
+                break
+        # Same as Lua: a table with the keys 1 to n is a list
+        if len(fields) and list(fields) == list(range(1, len(fields) + 1)):
+            return list(fields.values())
+        return fields
+
+    def chunk(self) -> Any:
+        self.expect("name", "do")
+        self.expect("name", "local")
+        name = self.expect("name")
+        self.expect("=")
+        self.expect("{")
+        out = self.table()
+        self.skip(";")
+        self.expect("name", "return")
+        if self.expect("name") != name:
+            raise MapSyntaxError("Map returns something other than its table")
+        self.skip(";")
+        self.expect("name", "end")
+        if self.i != len(self.tokens):
+            raise MapSyntaxError("Trailing code after map")
+        return out
+
+
+def parse_map(raw: bytes) -> list[dict[str, Any]]:
+    """Parses a decompressed map into its tiles, using Lua's parser if it isn't a plain table dump."""
+    try:
+        return _Parser(_tokenize(raw)).chunk()
+    except MapSyntaxError:
+        return parse_lua(raw.decode("utf-8"))
+
+
+def parse_level(obj: dict[str, Any]) -> tuple[dict[str, Any], list[tuple]]:
+    """Parses a level into its metadata and tiles, without needing the bot, so that it can run in another process.
+    Tiles are compact records of (tile, x, y, dir, color)."""
+    meta = {
+        "width": obj["width"],
+        "height": obj["height"],
+        "name": obj["name"],
+        "palette": obj["palette"],
+        "background": obj["background_sprite"] if obj.get("background_sprite", None) else None,
+        "author": obj["author"]
+    }
+    tiles = [
+        (tile["tile"], tile["x"], tile["y"], tile.get("dir", 1), tile.get("color", None))
+        for tile in parse_map(zlib.decompress(base64.b64decode(obj["map"])))
+    ]
+    return meta, tiles
+
+
+def parse_level_file(raw: bytes) -> tuple[dict[str, Any], list[tuple]] | None:
+    """Parses a .bab file, or returns None if it isn't a level."""
+    try:
+        return parse_level(json.loads(raw))
+    # Anything from bad JSON or zlib to whatever luaparser raises on bad Lua just means it isn't one
+    except Exception:
+        return None
+
+
+def parse_lua(lua_code: str) -> list[dict[str, Any]]:
+    # Slow to import, and rarely needed
+    import luaparser.ast as lua
+
+    lua_ast = lua.parse(lua_code)
+
+    for node in lua_ast.body.body[0].body.body:
+        if isinstance(node, lua.Return):
+            return_node = node
+            break
+    else:
+        raise AssertionError("Could not find return statement")
+
+    for node in lua.walk(lua_ast):
+        node: lua.Node
+        if isinstance(node, lua.LocalAssign):
+            node: lua.LocalAssign
+            if node.targets[0].id == return_node.values[0].id:
+                map_data: lua.Node = node.values[0]
+                break
+    else:
+        raise AssertionError("Could not find assignment")
+
+    def to_python(value) -> Any:
+        if isinstance(value, lua.String):
+            return value.s
+        elif isinstance(value, lua.Name):
+            return value.id
+        elif isinstance(value, lua.Table):
+            if len(value.fields) and all(isinstance(f.key, lua.Number) for f in value.fields):
+                nums = [f.key.n for f in value.fields]
+                if nums[0] == 1 and nums == list(range(min(nums), max(nums)+1)):
+                    return [to_python(f.value) for f in value.fields]
+            return {to_python(f.key): to_python(f.value) for f in value.fields}
+        elif isinstance(value, lua.Number):
+            return value.n
+        elif isinstance(value, lua.Nil):
+            return None
+        else:
+            raise AssertionError(f"Could not convert {value} to a python object")
+
+    return to_python(map_data)
@@ -0,0 +1,72 @@
+import bisect
+import heapq
+from typing import Iterable
+
+import numpy as np
+
+
+def characters(name: str) -> int:
+    """A bitmask of which characters are in a name. Anything but letters and digits shares one bit."""
+    mask = 0
+    for char in name:
+        if "a" <= char <= "z":
+            mask |= 1 << (ord(char) - ord("a"))
+        elif "0" <= char <= "9":
+            mask |= 1 << (26 + ord(char) - ord("0"))
+        else:
+            mask |= 1 << 36
+    return mask
+
+
+def fuzzy_score(query: str, name: str) -> tuple[int, int, int] | None:
+    """How well a name matches a query, lower being better, or None if the query isn't a subsequence of it."""
+    position = start = -1
+    gaps = 0
+    for char in query:
+        found = name.find(char, position + 1)
+        if found == -1:
+            return None
+        if position == -1:
+            start = found
+        else:
+            gaps += found - position - 1
+        position = found
+    return gaps, start, len(name)
+
+
+class NameIndex:
+    """Names sorted for prefix lookups, with masks of their characters to rule most of them out of fuzzy ones.
+    Matching ignores case."""
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.names = sorted(names, key=str.lower)
+        self.folded = [name.lower() for name in self.names]
+        self.masks = np.array([characters(name) for name in self.folded], dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def prefixed(self, prefix: str, limit: int = 25) -> list[str]:
+        """Names that start with a prefix, in order."""
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.folded, prefix)
+        end = min(bisect.bisect_left(self.folded, prefix + chr(0x10FFFF), start), start + limit)
+        return self.names[start:end]
+
+    def fuzzy(self, query: str, limit: int = 25) -> list[str]:
+        """Names that have the characters of a query in the same order, best matches first."""
+        query = query.lower()
+        mask = np.uint64(characters(query))
+        scored = []
+        for i in np.flatnonzero((self.masks & mask) == mask):
+            if (score := fuzzy_score(query, self.folded[i])) is not None:
+                scored.append((score, i))
+        return [self.names[i] for _, i in heapq.nsmallest(limit, scored)]
+
+    def complete(self, query: str, limit: int = 25) -> list[str]:
+        """Names that start with a query, then ones that fuzzily match it, for autocomplete."""
+        out = self.prefixed(query, limit)
+        if len(out) < limit:
+            prefixed = set(out)
+            out += [name for name in self.fuzzy(query, limit + len(out)) if name not in prefixed][:limit - len(out)]
+        return out
@@ -0,0 +1,127 @@
+from typing import Callable
+
+import cv2
+import numpy as np
+
+from src.cache import LRUCache
+from src.constants import SPRITE_CHAIN_CACHE_SIZE
+
+# Sprite variants, compiled from a tile's chain of them into as few passes over its sprites as possible.
+# Runs of flips and crops become a single view of each sprite, and blank and outline share the mask
+# of where the sprites are until something changes it.
+
+# A chain of sprite variants, as (variant class name, arguments)
+Chain = tuple[tuple[str, tuple], ...]
+View = tuple[slice, slice]
+
+FLIPS: dict[str, View] = {"x": (slice(None), slice(None, None, -1)), "y": (slice(None, None, -1), slice(None))}
+
+
+def union_mask(sprites: list[np.ndarray]) -> np.ndarray:
+    """Where any of a tile's sprites are visible, with all of them centered on the largest."""
+    mask = np.zeros(np.amax([sprite.shape[:2] for sprite in sprites], axis=0), dtype=bool)
+    for sprite in sprites:
+        bounds = (
+            slice(int((mask.shape[0] - sprite.shape[0]) // 2), int(((mask.shape[0] + sprite.shape[0]) // 2))),
+            slice(int((mask.shape[1] - sprite.shape[1]) // 2), int(((mask.shape[1] + sprite.shape[1]) // 2)))
+        )
+        mask[bounds] |= sprite[..., 3] > 0
+    return mask
+
+
+def mask_sprite(mask: np.ndarray) -> np.ndarray:
+    """A solid white sprite in the shape of a mask."""
+    out = np.zeros((*mask.shape, 4), dtype=np.uint8)
+    out[mask] = 255
+    return out
+
+
+def outline_sprites(sprites: list[np.ndarray], mask: np.ndarray, edges: bool) -> list[np.ndarray]:
+    """Outlines sprites, leaving out where the mask is."""
+    edges = int(edges)
+    kernel = np.array((
+        (edges, 1, edges),
+        (    1, 0, 1    ),
+        (edges, 1, edges)
+    ), dtype=float)
+    out = []
+    for sprite in sprites:
+        # Stays uint8, so this saturates instead of overflowing
+        filtered_sprite = cv2.filter2D(src=np.ascontiguousarray(sprite), ddepth=-1, kernel=kernel)
+        filtered_sprite[mask, 3] = 0
+        out.append(filtered_sprite)
+    return out
+
+
+def compose(shape: tuple[int, ...], views: list[View]) -> View:
+    """Composes views of an array, applied one after the other, into one view of it."""
+    composed = []
+    for axis in range(2):
+        # Ranges slice the same way as arrays, and stay ranges
+        indices = range(shape[axis])
+        for view in views:
+            indices = indices[view[axis]]
+        if not len(indices):
+            composed.append(slice(0, 0))
+        else:
+            composed.append(slice(indices.start, indices.stop if indices.stop >= 0 else None, indices.step))
+    return tuple(composed)
+
+
+def flip(axis: str) -> View:
+    assert axis in FLIPS, f"bad varint proprtie `{axis}`!!"
+    return FLIPS[axis]
+
+
+def crop(x: int, y: int, u: int, v: int) -> View:
+    return slice(y, v), slice(x, u)
+
+
+# Stages take the sprites and their mask, if it's known, and give back new ones
+def blank(sprites: list[np.ndarray], mask: np.ndarray | None) -> tuple[list[np.ndarray], np.ndarray | None]:
+    mask = union_mask(sprites) if mask is None else mask
+    # Blanking doesn't move anything, so the mask stays the same
+    return [mask_sprite(mask)], mask
+
+
+def outline(edges: bool | None = None) -> Callable:
+    def stage(sprites: list[np.ndarray], mask: np.ndarray | None) -> tuple[list[np.ndarray], np.ndarray | None]:
+        return outline_sprites(sprites, union_mask(sprites) if mask is None else mask, True if edges is None else edges), None
+    return stage
+
+
+VIEWS: dict[str, Callable[..., View]] = {"FlipVariant": flip, "CropVariant": crop}
+STAGES: dict[str, Callable[..., Callable]] = {"BlankVariant": lambda: blank, "OutlineVariant": outline}
+
+compiled_chains = LRUCache(SPRITE_CHAIN_CACHE_SIZE, sizeof=lambda _: 1)
+
+
+def compile_chain(chain: Chain) -> Callable[[list[np.ndarray]], list[np.ndarray]] | None:
+    """Compiles a chain of sprite variants into one function of a tile's sprites.
+    Returns None if any of them can't be compiled, and have to be called on the tile instead."""
+    if chain in compiled_chains:
+        return compiled_chains.get(chain)
+    if not all(name in VIEWS or name in STAGES for name, _ in chain):
+        compiled_chains[chain] = None
+        return None
+    stages: list[list[View] | Callable] = []
+    for name, args in chain:
+        if name in VIEWS:
+            if not len(stages) or not isinstance(stages[-1], list):
+                stages.append([])
+            stages[-1].append(VIEWS[name](*args))
+        else:
+            stages.append(STAGES[name](*args))
+
+    def run(sprites: list[np.ndarray]) -> list[np.ndarray]:
+        mask = None
+        for stage in stages:
+            if isinstance(stage, list):
+                sprites = [sprite[compose(sprite.shape, stage)] for sprite in sprites]
+                mask = None
+            else:
+                sprites, mask = stage(sprites, mask)
+        return sprites
+
+    compiled_chains[chain] = run
+    return run
@@ -0,0 +1,42 @@
+import math
+
+import cv2
+import numpy as np
+
+
+def rotation_scale(rotation: float) -> float:
+    """How much larger a sprite's bounding box gets when it's rotated by an angle."""
+    return math.cos(math.radians(-rotation % 90)) + math.sin(math.radians(-rotation % 90))
+
+
+def rescale(sprite: np.ndarray, x: float, y: float) -> np.ndarray:
+    """Scales a sprite with nearest-neighbor sampling. Negative scales flip it."""
+    if x < 0:
+        sprite = sprite[:, ::-1]
+    if y < 0:
+        sprite = sprite[::-1]
+    x, y = abs(x), abs(y)
+    if x == 1 and y == 1:
+        return sprite
+    if float(x).is_integer() and float(y).is_integer():
+        return np.repeat(np.repeat(sprite, int(y), axis=0), int(x), axis=1)
+    return cv2.resize(np.ascontiguousarray(sprite), (0, 0), fx=x, fy=y, interpolation=cv2.INTER_NEAREST)
+
+
+def rotate(sprite: np.ndarray, angle: float) -> np.ndarray:
+    """Rotates a sprite clockwise by an angle in degrees."""
+    angle %= 360
+    if angle % 90 == 0:
+        # Orthogonal rotations don't need to be resampled
+        return np.rot90(sprite, -int(angle // 90))
+    scale = rotation_scale(angle)
+    padding = math.floor(sprite.shape[0] * ((scale - 1) / 2)), math.floor(sprite.shape[1] * ((scale - 1) / 2))
+    sprite = np.pad(sprite, (padding, padding, (0, 0)))
+    h, w = sprite.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), -angle, 1.)
+    return cv2.warpAffine(sprite, matrix, (w, h), flags=cv2.INTER_NEAREST)
+
+
+def transform(sprite: np.ndarray, rotation: float, scale: tuple[float, float]) -> np.ndarray:
+    """Scales, then rotates a sprite. Identity transforms return the sprite itself."""
+    return rotate(rescale(sprite, *scale), rotation)
@@ -1,9 +1,7 @@
-import base64
 import copy
 import dataclasses
 import re
 import warnings
-import zlib
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 from datetime import datetime
@@ -14,17 +12,22 @@ import json
 import asqlite
 import numpy as np
 from discord.ext import commands
-import luaparser.ast as lua
 
-from src import constants
-from src.utils import cast
+from src import constants, mapparser
+from src.cache import LRUCache
+from src.names import NameIndex
+from src.utils import converter
 
 
 @dataclass
 class TileData:
     colors: list[list[int, int] | list[int, int, int]]
-    sprites: list[np.ndarray] = field(repr=False)
-    slep_sprites: list[np.ndarray] | None = field(default=None, repr=False)
+    # Length-prefixed PNGs, straight from the database. Database.sprites decodes them.
+    raw_sprites: bytes = field(repr=False)
+    # Where each PNG in the raw sprites starts and ends
+    sprite_spans: list[tuple[int, int]] = field(repr=False)
+    raw_slep_sprites: bytes | None = field(default=None, repr=False)
+    slep_spans: list[tuple[int, int]] | None = field(default=None, repr=False)
     painted: list[bool | list[int, int] | list[int, int, int]] | None = None
     rotate: bool = True
     layer: int | None = None
@@ -32,42 +35,75 @@ class TileData:
 
 class Database:
     conn: asqlite.Connection
+    readers: asqlite.Pool
     bot: None
+    path: str
     tiles: dict[str, TileData]
     palettes: dict[str, np.ndarray]
     overlays: dict[str, np.ndarray]
     worlds: dict[str, dict[str, "LevelData"]]
     level_names: dict[str, tuple[str, str]]
+    tile_index: NameIndex
+    palette_index: NameIndex
+    level_index: NameIndex
+    asset_hashes: dict[tuple[str, str], str]
+    reload_callbacks: list[Callable[[str, list[str] | None], Any]]
 
     def __init__(self, bot): ...
 
-    async def connect(self, db: str) -> None: ...
+    async def connect(self, db: str, readonly: bool = False) -> None: ...
 
     async def close(self, code: int = 0) -> None: ...
 
     async def create_tables(self) -> None: ...
 
-    async def load_tiles(self, *, flush: bool = False) -> None: ...
+    async def reload(self, kind: str, names: list[str] | None = None) -> None: ...
+
+    async def load_tiles(self, *, flush: bool = False, names: list[str] | None = None) -> None: ...
 
-    async def load_palettes(self) -> None: ...
+    async def ingest_tiles(self) -> list[str]: ...
 
-    async def load_overlays(self) -> None: ...
+    async def load_palettes(self, names: list[str] | None = None) -> None: ...
+
+    async def load_overlays(self, names: list[str] | None = None) -> None: ...
 
     async def load_worlds(self) -> None: ...
 
+    def reloaded(self, kind: str, names: list[str] | None = None) -> None: ...
+
+    def sprites(self, name: str, slep: bool = False) -> list[np.ndarray]: ...
+
+    async def build_atlas(self) -> None: ...
+
+    async def cached_render(self, key: str) -> tuple[bytes, str] | None: ...
+
+    async def cache_render(self, key: str, data: bytes, format: str) -> None: ...
+
 
 
 class Variant(ABC):
     description: str
     signature: list[type]
     syntax: Pattern
+    # Matches only the arguments, after the name or alias
+    arguments: Pattern
     func: Callable
     type: Literal["tile", "sprite", "post"]
-    names: list[str]
+    aliases: list[str]
+    # Variant classes are made at runtime, so they can't be pickled by reference.
+    # This lets them be sent to the render workers by name instead.
+    registry: dict[str, type["Variant"]] = {}
 
     def __init__(self, *args: Any | None):
         self.args = args
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        Variant.registry[cls.__name__] = cls
+
+    def __reduce__(self):
+        return load_variant, (self.__class__.__name__, self.args)
+
     @abstractmethod
     def call(self, tile):
         raise NotImplementedError
@@ -76,14 +112,53 @@ class Variant(ABC):
         return f"{self.__class__.__name__}({','.join([f'{key}={value}' for key, value in self.__dict__.items()])})"
 
 
+def load_variant(name: str, args: tuple) -> Variant:
+    return Variant.registry[name](*args)
+
+
 class VariantList(list):
-    def find(self, name: str) -> Variant | None:
-        for variant in self:
-            variant: Variant
-            if variant.__name__.lower().startswith(name.lower()):
-                return variant
+    def __init__(self, *args):
+        super().__init__(*args)
+        # Every way to write a variant, as (name or alias, variant, argument pattern, argument converters),
+        # keyed by the first character of the name and in the order the variants were registered.
+        self.index: dict[str, list[tuple[str, type[Variant], Pattern, list[Callable]]]] = {}
+        # The ones that have no name at all, which is all that a variant with an unknown first character can be
+        self.unnamed: list[tuple[str, type[Variant], Pattern, list[Callable]]] = []
+        self.found: dict[str, type[Variant] | None] = {}
+        # Tiles as written in grids, parsed into their name and variants, since grids repeat the same few a lot
+        self.parsed_tiles = LRUCache(constants.PARSED_TILE_CACHE_SIZE, sizeof=lambda _: 1)
+        self.name_index = NameIndex()
+
+    def register(self, variant: type[Variant]):
+        self.append(variant)
+        entries = [
+            (alias, registered, registered.arguments, [converter(arg_type) for arg_type in registered.signature])
+            for registered in self for alias in registered.aliases
+        ]
+        self.unnamed = [entry for entry in entries if entry[0] == ""]
+        self.index = {
+            first: [entry for entry in entries if entry[0][:1] in ("", first)]
+            for first in {entry[0][0] for entry in entries if entry[0] != ""}
+        }
+        self.found.clear()
+        self.parsed_tiles.clear()
+        self.name_index = NameIndex(registered.__name__.removesuffix("Variant") for registered in self)
+
+    def parse(self, string: str) -> Variant | None:
+        """Parses a variant as written in a tile, or returns None if nothing matches it."""
+        for alias, variant, arguments, converters in self.index.get(string[:1], self.unnamed):
+            if string.startswith(alias) and (match := arguments.fullmatch(string, len(alias))):
+                return variant(*(convert(arg) for convert, arg in zip(converters, match.groups())))
         return None
 
+    def find(self, name: str) -> Variant | None:
+        name = name.lower()
+        if name not in self.found:
+            self.found[name] = next((
+                variant for variant in self if variant.__name__.lower().startswith(name)
+            ), None)
+        return self.found[name]
+
 
 class Bot(commands.Bot):
     started: datetime
@@ -108,23 +183,24 @@ class TileSkeleton:
     color: tuple[int, int] | None = None
 
     @classmethod
-    def parse(cls, string: str, position: tuple[int, int], possible_variants: list, color: tuple[int, int] = None, layer: int = None):
-        name, *variants = re.split(r"(?<!\\):", string)
-        assert "slab" not in name, "fuck slab hope she fuckign    dies or smtjh"
+    def parse(cls, string: str, position: tuple[int, int], possible_variants: VariantList, color: tuple[int, int] = None, layer: int = None):
+        parsed = possible_variants.parsed_tiles.get(string)
+        if parsed is None:
+            name, *variants = re.split(r"(?<!\\):", string)
+            assert "slab" not in name, "fuck slab hope she fuckign    dies or smtjh"
+            variants: list[str]
+            parsed_variants: list[Variant] = []
+            if len(name) and name != "-":
+                for variant in variants:
+                    parsed_variant = possible_variants.parse(variant)
+                    assert parsed_variant is not None, f"whar is varinnt `{variant}`??"
+                    parsed_variants.append(parsed_variant)
+            parsed = name, tuple(parsed_variants)
+            possible_variants.parsed_tiles[string] = parsed
+        name, variants = parsed
         if not len(name) or name == "-": return None
-        variants: list[str]
-        parsed_variants: list[Variant] = []
-        for variant in variants:
-            # Tried to use a for-else here, but Python disagreed.
-            found_variant = False
-            for possible_variant in possible_variants:
-                if match := re.fullmatch(possible_variant.syntax, variant):
-                    parsed_variants.append(possible_variant(
-                        *(cast(arg_type, arg) for arg_type, arg in zip(possible_variant.signature, match.groups()))))
-                    found_variant = True
-                    break
-            assert found_variant, f"whar is varinnt `{variant}`??"
-        return cls(name, parsed_variants, *position, layer, color)
+        # Variants aren't changed after parsing, so copies of the same tile can share them
+        return cls(name, list(variants), *position, layer, color)
 
     def __iter__(self):
         # Made for level saving, doesn't need to work elsewhere
@@ -133,18 +209,6 @@ class TileSkeleton:
                 yield key, getattr(self, key)
 
 
-def to_tuple(val: Any) -> tuple:
-    val = copy.deepcopy(val)
-    try:
-        if isinstance(val, str):
-            raise TypeError
-        for i, entry in enumerate(val):
-            val[i] = to_tuple(val[i])
-    except TypeError:
-        return val
-    return tuple(val)
-
-
 @dataclass
 class Tile:
     name: str
@@ -157,62 +221,64 @@ class Tile:
     sprites: list[np.ndarray] = field(repr=False)
     palette: str = "default"
     slep: bool = False
+    # Everything that goes into the tile's processed sprite, set once it's built
+    key: tuple = field(default=(), repr=False, compare=False)
 
     @classmethod
-    # data is passed by reference
-    async def build(cls, skel: TileSkeleton, tile_data: TileData):
-        tile_data = copy.deepcopy(tile_data)
+    async def build(cls, skel: TileSkeleton, db: Database, palette: str = "default"):
+        # Tile data and sprites are shared between every tile of the same name, and read-only.
+        # Tile variants only change the colors, so those are the only thing copied.
+        tile_data = db.tiles[skel.name]
         tile = cls(
             skel.name,
-            skel.variants,
+            [variant for variant in skel.variants if variant.type != "tile"],
             skel.x,
             skel.y,
-            skel.z if skel.z is not None else tile_data.layer if tile_data.layer is not None else 0 ,
-            [skel.color for _ in tile_data.painted] if skel.color is not None else tile_data.colors,
+            skel.z if skel.z is not None else tile_data.layer if tile_data.layer is not None else 0,
+            [skel.color for _ in tile_data.painted] if skel.color is not None else list(tile_data.colors),
             tile_data.painted,
-            tile_data.sprites
+            db.sprites(skel.name),
+            palette
         )
-        for i, variant in enumerate(skel.variants):
+        for variant in skel.variants:
             if variant.type == "tile":
                 await variant.call(tile)
-                del skel.variants[i]
-        if tile.slep and tile_data.slep_sprites is not None:
-            tile.sprites = tile_data.slep_sprites
+        if tile.slep:
+            tile.sprites = db.sprites(skel.name, slep=True)
+        # Sprite variants replace the sprites in this list, rather than writing to them
+        tile.sprites = list(tile.sprites)
+        tile.key = (
+            tile.name,
+            tile.slep,
+            tuple((variant.__class__.__name__, variant.args) for variant in tile.variants if variant.type == "sprite"),
+            tuple(color if isinstance(color, str) else tuple(color) for color in tile.colors),
+            tuple(paint if isinstance(paint, bool) else tuple(paint) for paint in tile.painted),
+            tile.palette
+        )
         return tile
 
+    @staticmethod
+    def resolve_name(name: str, rul: bool = False) -> str:
+        """Gets the name of the tile that a name in a grid refers to."""
+        name = re.sub(r"\\(.)", r"\1", name)
+        if rul:
+            if name.startswith("til_"):
+                return name[4:]
+            return f"txt_{name}"
+        return name
+
     @staticmethod
     async def build_tiles(raw_tiles: list, ctx, bot) -> list:
         tiles = []
         for skel in raw_tiles:
             if skel is not None:
-                skel.name = re.sub(r"\\(.)", r"\1", skel.name)
-                if ctx.rul:
-                    if skel.name.startswith("til_"):
-                        skel.name = skel.name[4:]
-                    else:
-                        skel.name = f"txt_{skel.name}"
+                skel.name = Tile.resolve_name(skel.name, ctx.rul)
                 assert skel.name in bot.db.tiles, f"wat is `{skel.name}`????"
-                tile = await Tile.build(skel, bot.db.tiles[skel.name])
-                tile.palette = ctx.palette
+                tile = await Tile.build(skel, bot.db, ctx.palette)
                 tiles.append(tile)
         return tiles
 
 
-    def __hash__(self):
-        for i in range(len(self.sprites)):
-            self.sprites[i].flags.writeable = False
-        tile_hash = hash((
-            self.name,
-            tuple(variant for variant in self.variants if variant.type != "post"),
-            to_tuple(self.colors),
-            to_tuple(self.painted)
-            # Sprites don't actually need to be hashed
-        ))
-        for i in range(len(self.sprites)):
-            self.sprites[i].flags.writeable = True
-        return tile_hash
-
-
 @dataclass
 class ProcessedTile:
     name: str
@@ -224,6 +290,40 @@ class ProcessedTile:
     scale: list[int, int] = field(default_factory=lambda: [1, 1])
     rotation: float = 0
     palette: str = "default"
+    blending: str = "normal"
+    wobble: bool = True
+
+
+@dataclass(frozen=True)
+class Draw:
+    sprite: np.ndarray = field(repr=False)
+    # Where the center of the sprite goes on the canvas
+    x: float
+    y: float
+    rotation: float
+    scale: tuple[float, float]
+    blending: str
+    wobble: bool
+
+
+@dataclass(frozen=True)
+class RenderPlan:
+    """Where everything goes in a render, worked out before any pixels are touched."""
+    width: int
+    height: int
+    # The canvas position of the top left corner of the grid, and the size of its cells
+    origin: tuple[int, int]
+    cell: int
+    # In the order they're drawn
+    draws: tuple[Draw, ...]
+
+    @property
+    def cost(self) -> int:
+        """Roughly how many pixels rendering a frame of this plan touches."""
+        return self.width * self.height + sum(
+            int(draw.sprite.shape[0] * draw.sprite.shape[1] * abs(draw.scale[0] * draw.scale[1]))
+            for draw in self.draws
+        )
 
 
 @dataclass
@@ -235,6 +335,8 @@ class RenderingContext:
     width: int = 0
     height: int = 0
     rul: bool = False
+    frames: int = 1
+    format: Literal["png", "gif", "webp"] = "png"
 
 
 @dataclass
@@ -264,78 +366,33 @@ class LevelData:
             yield key, value
 
     @classmethod
-    def from_json(cls, obj: dict[str, Any], bot: Bot) -> Self:
+    def from_json(cls, obj: dict[str, Any], bot: Bot) -> Self | None:
         # bot is passed because it's the easiest way to get it here
         try:
-            out = cls(
-                width=obj["width"],
-                height=obj["height"],
-                name=obj["name"],
-                palette=obj["palette"],
-                background=obj["background_sprite"] if obj.get("background_sprite", None) else None,
-                author=obj["author"]
-            )
-
-            # Parse Lua code to a map
-
-            lua_code = zlib.decompress(base64.b64decode(obj["map"])).decode("utf-8")
-            lua_ast = lua.parse(lua_code)
-
-            for node in lua_ast.body.body[0].body.body:
-                if isinstance(node, lua.Return):
-                    return_node = node
-                    break
-            else:
-                raise AssertionError("Could not find return statement")
-
-            for node in lua.walk(lua_ast):
-                node: lua.Node
-                if isinstance(node, lua.LocalAssign):
-                    node: lua.LocalAssign
-                    if node.targets[0].id == return_node.values[0].id:
-                        map_data: lua.Node = node.values[0]
-                        break
-            else:
-                raise AssertionError("Could not find assignment")
-
-            def to_python(value) -> Any:
-                if isinstance(value, lua.String):
-                    return value.s
-                elif isinstance(value, lua.Name):
-                    return value.id
-                elif isinstance(value, lua.Table):
-                    if len(value.fields) and all(isinstance(f.key, lua.Number) for f in value.fields):
-                        nums = [f.key.n for f in value.fields]
-                        if nums[0] == 1 and nums == list(range(min(nums), max(nums)+1)):
-                            return [to_python(f.value) for f in value.fields]
-                    return {to_python(f.key): to_python(f.value) for f in value.fields}
-                elif isinstance(value, lua.Number):
-                    return value.n
-                elif isinstance(value, lua.Nil):
-                    return None
-                else:
-                    raise AssertionError(f"Could not convert {value} to a python object")
-
-            map_data: list[dict[str, Any]] = to_python(map_data)
-            out.tiles = []
-            for tile in map_data:
-                out.tiles.append(
-                    TileSkeleton(
-                        tile["tile"],
-                        [bot.variants.find("rotate")((tile["dir"] - 1) * 45)] if bot.db.tiles[tile["tile"]].rotate else [],
-                        tile["x"],
-                        tile["y"],
-                        None,
-                        tile.get("color", None)
-                    )
-                )
-
-            return out
-
+            meta, tiles = mapparser.parse_level(obj)
         except KeyError:
             o = obj.copy()
             if "map" in o:
                 del o["map"]
             warnings.warn(f"Could not parse:\n{o}")
+            return None
+        return cls.from_records(meta, tiles, bot)
 
-            return None
\ No newline at end of file
+    @classmethod
+    def from_records(cls, meta: dict[str, Any], tiles: list[tuple], bot: Bot) -> Self | None:
+        """Makes a level from what mapparser.parse_level returns."""
+        try:
+            return cls(**meta, tiles=[
+                TileSkeleton(
+                    tile,
+                    [bot.variants.find("rotate")((direction - 1) * 45)] if bot.db.tiles[tile].rotate else [],
+                    x,
+                    y,
+                    None,
+                    color
+                )
+                for tile, x, y, direction, color in tiles
+            ])
+        except KeyError as err:
+            warnings.warn(f"Could not parse {meta}: no tile {err}")
+            return None
@@ -1,5 +1,5 @@
 import types
-from typing import get_args, Any
+from typing import get_args, Any, Callable
 
 from discord import Interaction
 
@@ -31,3 +31,24 @@ def cast(t: type, value: Any):
     if isinstance(value, str) and t == bool:
         return value in ("1", "true", "True")
     return t(value)
+
+
+def converter(t: type) -> Callable[[Any], Any]:
+    """Works out how cast would convert values to a type once, so it doesn't have to for every value."""
+    if isinstance(t, types.UnionType):
+        members = [converter(cls) for cls in get_args(t) if cls is not types.NoneType]
+        optional = types.NoneType in get_args(t)
+
+        def convert(value):
+            if value is None and optional:
+                return None
+            for member in members:
+                try:
+                    return member(value)
+                except (TypeError, ValueError):
+                    pass
+            raise ValueError(f"Could not cast {value} to {t}")
+        return convert
+    if t == bool:
+        return lambda value: value in ("1", "true", "True") if isinstance(value, str) else bool(value)
+    return lambda value: value if isinstance(value, t) else t(value)
@@ -0,0 +1,83 @@
+import asyncio
+from io import BytesIO
+from typing import Any, Callable, Coroutine
+
+from src.db import Database
+from src.types import TileSkeleton, RenderingContext, Tile, LevelData, VariantList
+
+# The render pipeline, and the process pool workers that run it.
+# Every pipeline function takes the bot as its first argument, so it can be run
+# either inline with the real bot, or in a worker with a headless one.
+
+
+class HeadlessBot:
+    """Just enough of a bot to build, process and render tiles outside of discord.py."""
+
+    def __init__(self):
+        self.db = Database(self)
+        self.variants = VariantList()
+        self.renderer = None
+
+    async def add_cog(self, cog, **kwargs):
+        pass
+
+
+bot: HeadlessBot | None = None
+loop: asyncio.AbstractEventLoop | None = None
+# The last asset change this worker reloaded
+applied_change = 0
+
+
+def initialize(db_path: str, workers: int):
+    """Loads everything a worker needs, once, when it starts up."""
+    global bot, loop
+    # Imported here, since the render cog imports this module
+    from src.cogs import render, variants
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    bot = HeadlessBot()
+
+    async def setup():
+        await variants.setup(bot)
+        await render.setup(bot)
+        await bot.db.connect(db_path, readonly=True)
+
+    loop.run_until_complete(setup())
+    # The cache sizes are for rendering as a whole, so each worker gets its share of them
+    for cache in (bot.renderer.tile_cache, bot.renderer.recolor_cache, bot.db.sprite_cache):
+        if cache.max_size is not None:
+            cache.max_size //= workers
+
+
+def call(changes: list[tuple[int, str, list[str]]], func: Callable[..., Coroutine], *args: Any) -> Any:
+    """Reloads any assets that changed since this worker last ran something, then runs a pipeline function in it."""
+    global applied_change
+    for number, kind, names in changes:
+        if number > applied_change:
+            loop.run_until_complete(bot.db.reload(kind, names))
+            applied_change = number
+    return loop.run_until_complete(func(bot, *args))
+
+
+async def render_tiles(bot, skeletons: list[TileSkeleton], ctx: RenderingContext) -> tuple[bytes, str]:
+    """Renders tiles, returning the file and its format."""
+    tiles = await Tile.build_tiles(skeletons, ctx, bot)
+    assert len(tiles), "wher tils"
+    tiles = await bot.renderer.process(tiles, ctx)
+    plan = bot.renderer.plan(tiles, ctx)
+    with BytesIO() as buf:
+        format = await bot.renderer.render(plan, buf, ctx)
+        return buf.getvalue(), format
+
+
+async def parse_level(bot, raw_level: dict[str, Any]) -> LevelData | None:
+    return LevelData.from_json(raw_level, bot)
+
+
+async def cache_stats(bot) -> dict[str, str]:
+    return {
+        "processed tiles": repr(bot.renderer.tile_cache),
+        "recolored layers": repr(bot.renderer.recolor_cache),
+        "decoded sprites": repr(bot.db.sprite_cache)
+    }